@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Authors:
+#    Eugenio "g7" Paolantonio <me@medesimo.eu>
+#
+
+import re
+import time
+
+# Phases, in the order dpkg goes through them
+PHASE_PREPARE = "prepare"
+PHASE_UNPACK = "unpack"
+PHASE_SETUP = "setup"
+PHASE_REMOVE = "remove"
+PHASE_TRIGGERS = "triggers"
+PHASE_ERROR = "error"
+
+LINE_RE = re.compile(
+	r"^(?:"
+	r"Preparing to unpack \S*?(?P<prepare>[^/\s_]+)_\S+ \.\.\."
+	r"|Unpacking (?P<unpack>\S+) "
+	r"|Setting up (?P<setup>\S+) "
+	r"|Removing (?P<remove>\S+) "
+	r"|Processing triggers for (?P<triggers>\S+) "
+	r"|dpkg: error processing (?:package |archive )?(?P<error>\S+?):? "
+	r"|(?P<failure>E: .*)"
+	r")",
+	re.MULTILINE
+)
+
+# Phases charged to the unpack and to the configure stage of a package,
+# see AptLogParser.charge()
+UNPACK_PHASES = (PHASE_PREPARE, PHASE_UNPACK, PHASE_REMOVE)
+CONFIGURE_PHASES = (PHASE_SETUP, PHASE_TRIGGERS)
+
+class PackageEntry:
+	
+	"""
+	The phases a package went through during the installation.
+	
+	`phases` maps every phase to a (timestamp, offset, line) tuple, where
+	offset is the byte offset of the line in the log and line is its
+	number.
+	
+	`unpack_time` and `configure_time` are the seconds spent in the
+	unpack and in the configure stage of the package. apt unpacks
+	every package before configuring any of them, so the stages of a
+	package are far apart in time: the parser charges every interval
+	between two phase lines to the package of the earlier one.
+	"""
+	
+	__slots__ = ("name", "phases", "unpack_time", "configure_time")
+	
+	def __init__(self, name):
+		"""
+		Initializes the class.
+		"""
+		
+		self.name = name
+		self.phases = {}
+		
+		self.unpack_time = 0.0
+		self.configure_time = 0.0
+	
+	@property
+	def completed(self):
+		"""
+		True if the package has been set up or removed.
+		"""
+		
+		return PHASE_SETUP in self.phases or PHASE_REMOVE in self.phases
+	
+	@property
+	def duration(self):
+		"""
+		The time spent installing (or removing) the package, in seconds,
+		or None if it hasn't been completed yet.
+		"""
+		
+		if not self.completed:
+			return None
+		
+		return self.unpack_time + self.configure_time
+
+class AptLogParser:
+	
+	"""
+	A streaming parser for the dpkg/apt output in the system update log.
+	
+	Feed it with the chunks read by a Follower (they don't need to be
+	split on line boundaries). It builds an index of the packages,
+	mapping their name to a PackageEntry, so that the log section of a
+	package can be found without scanning the log.
+	
+	As the log has no timestamps, the phases are timestamped when they
+	are parsed: feed the parser while the installation is going on to
+	get meaningful durations. Lines parsed in the same chunk have the
+	same timestamp, and cost nothing.
+	"""
+	
+	def __init__(self):
+		"""
+		Initializes the class.
+		"""
+		
+		self.reset()
+	
+	def reset(self):
+		"""
+		Clears the index.
+		"""
+		
+		self.packages = {}
+		self.errors = []
+		
+		self.inode = None
+		
+		# Offset and number of the first line in self.pending
+		self.offset = 0
+		self.line = 0
+		
+		# Byte offset right after the last chunk
+		self.end = 0
+		
+		# The last, incomplete line
+		self.pending = ""
+		
+		# Counters used by get_progress()
+		self.unpacked = 0
+		self.completed = 0
+		
+		# Names of the unpacked and of the completed packages, in order
+		self.unpacked_names = []
+		self.completed_names = []
+		
+		# (entry, phase, timestamp) of the last phase line, whose
+		# package is charged for the time until the next one
+		self.last_phase = None
+	
+	def feed(self, text, inode=None, start=None, end=None):
+		"""
+		Parses a chunk of text.
+		
+		`inode` is the inode of the log, `start` and `end` the byte
+		offsets of what the chunk has been decoded from, as passed along
+		by the followers. The index is reset if the inode changes, or if
+		the chunk starts before the end of the previous one.
+		
+		The offsets of the lines are measured on the text, relative to
+		the offsets of the chunks: they're only approximate in chunks
+		with invalid sequences, up to the next chunk.
+		"""
+		
+		if inode != self.inode or (start is not None and start < self.end):
+			if self.inode is not None:
+				# Rotated or truncated
+				self.reset()
+			self.inode = inode
+		
+		if start is not None and start != self.end:
+			# Started (or resumed) in the middle of the log, the line
+			# being parsed is lost
+			self.pending = ""
+			self.offset = start
+		
+		text = self.pending + text
+		
+		# Only parse complete lines
+		complete = text.rfind("\n") + 1
+		self.pending = text[complete:]
+		
+		timestamp = time.time()
+		position = 0
+		
+		for match in LINE_RE.finditer(text, 0, complete):
+			# Keep offset and line number in sync with the match
+			line_start = match.start()
+			self.offset += len(text[position:line_start].encode("utf-8"))
+			self.line += text.count("\n", position, line_start)
+			position = line_start
+			
+			phase = match.lastgroup
+			name = match.group(phase)
+			
+			if phase == "failure":
+				self.errors.append((timestamp, self.offset, self.line, name))
+				continue
+			
+			# Strip the architecture qualifier
+			name = name.split(":", 1)[0]
+			
+			entry = self.packages.get(name)
+			if entry is None:
+				entry = self.packages[name] = PackageEntry(name)
+			
+			# The previous phase is over
+			self.charge(timestamp)
+			self.last_phase = (entry, phase, timestamp)
+			
+			if phase == PHASE_ERROR:
+				self.errors.append((timestamp, self.offset, self.line, name))
+			elif phase in entry.phases:
+				# Triggers can be processed more than once, keep the
+				# first occurrence
+				continue
+			
+			entry.phases[phase] = (timestamp, self.offset, self.line)
+			
+			if phase == PHASE_UNPACK:
+				self.unpacked += 1
+				self.unpacked_names.append(name)
+			elif phase in (PHASE_SETUP, PHASE_REMOVE):
+				self.completed += 1
+				self.completed_names.append(name)
+		
+		self.line += text.count("\n", position, complete)
+		
+		if end is None:
+			self.offset += len(text[position:complete].encode("utf-8"))
+		else:
+			# Measure the incomplete line from the end of the chunk, so
+			# that errors don't add up
+			self.offset = end - len(self.pending.encode("utf-8"))
+			self.end = end
+	
+	def charge(self, timestamp=None):
+		"""
+		Charges the time since the last phase line (up to `timestamp`,
+		or now) to its package.
+		
+		It's called for every phase line, and should be called once the
+		installation finished for the last one.
+		"""
+		
+		if self.last_phase is None:
+			return
+		
+		if timestamp is None:
+			timestamp = time.time()
+		
+		entry, phase, start = self.last_phase
+		elapsed = max(timestamp - start, 0)
+		
+		if phase in UNPACK_PHASES:
+			entry.unpack_time += elapsed
+		elif phase in CONFIGURE_PHASES:
+			entry.configure_time += elapsed
+		
+		self.last_phase = (entry, phase, timestamp)
+	
+	def get_progress(self, total):
+		"""
+		Returns an estimate of the installation progress (between 0.0
+		and 1.0), given the `total` number of packages that are going
+		to be installed, or None if it can't be estimated.
+		
+		Every package counts twice, once when unpacked and once when
+		configured. This assumes that the log only contains the current
+		run, as channels starts a new one for every installation.
+		"""
+		
+		if total <= 0:
+			return None
+		
+		return min((self.unpacked + self.completed) / (2.0 * total), 1.0)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Authors:
+#    Eugenio "g7" Paolantonio <me@medesimo.eu>
+#
+
+
+from gi.repository import GLib, Gio
+
+BUS_NAME = "org.semplicelinux.channels"
+
+# The system bus connection, and the callbacks waiting for it (None if
+# nobody asked for it yet)
+_connection = None
+_connection_callbacks = None
+
+# (name, path, interface) -> proxy, and the callbacks waiting for the
+# proxies still being created
+_proxies = {}
+_proxy_callbacks = {}
+
+def get_connection(callback):
+	"""
+	Calls `callback` with the system bus connection, connecting to the
+	bus (without blocking) the first time. `callback` gets None if the
+	connection failed.
+	
+	The connection is shared by every caller.
+	"""
+	
+	global _connection_callbacks
+	
+	if _connection is not None:
+		callback(_connection)
+	elif _connection_callbacks is not None:
+		_connection_callbacks.append(callback)
+	else:
+		_connection_callbacks = [callback]
+		Gio.bus_get(Gio.BusType.SYSTEM, None, _on_connection_ready)
+
+def _on_connection_ready(source, result):
+	"""
+	Fired when the system bus connection is ready.
+	"""
+	
+	global _connection, _connection_callbacks
+	
+	try:
+		_connection = Gio.bus_get_finish(result)
+	except GLib.Error:
+		_connection = None
+	
+	callbacks, _connection_callbacks = _connection_callbacks, None
+	
+	for callback in callbacks:
+		callback(_connection)
+
+def get_proxy(path, interface, callback, flags=Gio.DBusProxyFlags.NONE, name=BUS_NAME):
+	"""
+	Calls `callback` with a proxy for the object at `path`, creating it
+	(without blocking) the first time. `callback` gets None if the
+	proxy couldn't be created.
+	
+	Proxies are shared by every caller, so `flags` only matter the first
+	time.
+	"""
+	
+	key = (name, path, interface)
+	
+	if key in _proxies:
+		callback(_proxies[key])
+	elif key in _proxy_callbacks:
+		_proxy_callbacks[key].append(callback)
+	else:
+		_proxy_callbacks[key] = [callback]
+		
+		def on_connection_ready(connection):
+			if connection is None:
+				_on_proxy_ready(None, None, key)
+				return
+			
+			Gio.DBusProxy.new(
+				connection,
+				flags,
+				None,
+				name,
+				path,
+				interface,
+				None,
+				_on_proxy_ready,
+				key
+			)
+		
+		get_connection(on_connection_ready)
+
+def _on_proxy_ready(source, result, key):
+	"""
+	Fired when a proxy has been created.
+	"""
+	
+	proxy = None
+	if result is not None:
+		try:
+			proxy = _proxies[key] = Gio.DBusProxy.new_finish(result)
+		except GLib.Error:
+			pass
+	
+	for callback in _proxy_callbacks.pop(key):
+		callback(proxy)
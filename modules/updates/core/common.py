@@ -20,7 +20,18 @@
 #
 
 import os
+import re
+import math
+import mmap
+import fcntl
 import time
+import codecs
+import select
+
+import ctypes
+import ctypes.util
+
+from gi.repository import GLib, Gio
 
 # FIXME pending AppStream API update. See #4
 #from gi.repository import AppStream
@@ -28,38 +39,261 @@ import time
 #Database = AppStream.Database.new() 
 #Database.set_database_path("/var/cache/app-info")
 
+# inotify(7) flags
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+try:
+	_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+	_libc.inotify_init1
+	_libc.inotify_add_watch
+	INOTIFY_AVAILABLE = True
+except (OSError, AttributeError):
+	_libc = None
+	INOTIFY_AVAILABLE = False
+
+# Sizes as formatted by apt (and channels), e.g. "0 B", "12.3 MB", "950 kB"
+SIZE_RE = re.compile(r"^\s*(?P<number>\d+(?:[.,]\d+)?)\s*(?P<unit>[kKMGTPEZY]?)(?P<binary>i?)B?\s*$")
+SIZE_UNITS = "kMGTPEZY"
+
+def parse_size(size):
+	"""
+	Returns the number of bytes represented by the string `size`, or
+	-1 if it can't be parsed.
+	"""
+	
+	match = SIZE_RE.match(size or "")
+	if not match:
+		return -1
+	
+	number = float(match.group("number").replace(",", "."))
+	unit = match.group("unit")
+	
+	if unit:
+		number *= (1024 if match.group("binary") else 1000) ** (
+			SIZE_UNITS.index(unit.replace("K", "k")) + 1
+		)
+	
+	return int(round(number))
+
+def format_size(size):
+	"""
+	Returns the number of bytes `size`, formatted for display.
+	"""
+	
+	return GLib.format_size(size)
+
+def format_duration(seconds):
+	"""
+	Returns the number of `seconds`, formatted for display in the same
+	way apt does (e.g. "1h 20min 5s").
+	"""
+	
+	seconds = int(round(seconds))
+	
+	if seconds >= 3600:
+		return _("%(hours)dh %(minutes)dmin %(seconds)ds") % {
+			"hours" : seconds // 3600,
+			"minutes" : seconds % 3600 // 60,
+			"seconds" : seconds % 60
+		}
+	elif seconds >= 60:
+		return _("%(minutes)dmin %(seconds)ds") % {
+			"minutes" : seconds // 60,
+			"seconds" : seconds % 60
+		}
+	else:
+		return _("%ds") % seconds
+
+class RateEstimator:
+	
+	"""
+	Estimates the rate of a transfer, and the time left to complete
+	it, from the amount of data transferred so far.
+	
+	The rate is an exponentially weighted moving average of the rates
+	measured at every update() call, where the weight of a sample
+	decays with a time constant of `window` seconds, so that irregular
+	update intervals are handled correctly.
+	
+	Data is only added when an item has been transferred completely, so
+	update() calls in between don't take a sample: the next one measures
+	the whole span since the previous completion, item in flight
+	included. The last rate is held in the meantime, for `stale_after`
+	seconds at most.
+	"""
+	
+	def __init__(self, window=5.0, stale_after=10.0):
+		"""
+		Initializes the class.
+		"""
+		
+		self.window = window
+		self.stale_after = stale_after
+		
+		self.reset()
+	
+	def reset(self, total=-1):
+		"""
+		Starts a new transfer of `total` bytes (-1 if unknown).
+		"""
+		
+		self.total = total
+		self.done = 0
+		
+		# Bytes transferred since the last sample
+		self.pending = 0
+		self.last = time.monotonic()
+		
+		# Bytes per second, None until something has been transferred
+		self.rate = None
+	
+	def add(self, size):
+		"""
+		Tells the estimator that `size` more bytes have been transferred.
+		"""
+		
+		self.done += size
+		self.pending += size
+	
+	def update(self):
+		"""
+		Takes a sample and returns the new rate, or None if it's not
+		known (or not anymore).
+		"""
+		
+		now = time.monotonic()
+		elapsed = now - self.last
+		
+		if self.pending == 0:
+			# Nothing completed since the last sample, keep measuring
+			# from there
+			if elapsed > self.stale_after:
+				# Something is stuck, or the item in flight is huge:
+				# can't tell
+				return None
+			
+			return self.rate
+		
+		if elapsed <= 0:
+			return self.rate
+		
+		sample = self.pending / elapsed
+		
+		if self.rate is None:
+			self.rate = sample
+		else:
+			self.rate += (sample - self.rate) * (1 - math.exp(-elapsed / self.window))
+		
+		self.pending = 0
+		self.last = now
+		
+		return self.rate
+	
+	@property
+	def eta(self):
+		"""
+		The estimated number of seconds left, or None if unknown.
+		"""
+		
+		if not self.rate or self.total < 0:
+			return None
+		
+		return max(self.total - self.done, 0) / self.rate
+
 class Follower:
 	
 	"""
 	An equivalent of tail -f.
 	
-	Note: this performs checks on inodes, so it doesn't react when a
-	file truncation happens (but does properly reload the file on a log
-	rotation)
+	Iterating over a Follower yields chunks of text (not lines): every
+	chunk contains everything that has been appended to the file since
+	the previous one, up to CHUNK_SIZE bytes.
+	
+	The file is reloaded from the beginning when it gets rotated (its
+	inode changes) or truncated (it becomes shorter than what has
+	already been read).
+	
+	After every chunk, chunk_start and chunk_end are the byte offsets
+	in the file of the bytes it has been decoded from. They can differ
+	from what the text encodes to, as invalid sequences are replaced
+	and incomplete ones are held back until the rest is read.
 	"""
 	
-	def __init__(self, path):
+	# Maximum number of bytes read at once
+	CHUNK_SIZE = 256 * 1024
+	
+	def __init__(self, path, offset=0):
 		"""
 		Initializes the class.
 		
-		`path` is the file path to open.
+		`path` is the file path to open, `offset` is the byte offset
+		where to start reading from.
 		"""
 		
 		self.path = path
 		self.file = None
 		
 		self._stop = False
+		self._closed = False
+		
+		# Self-pipe used to wake up _wait() when stop() is called
+		self._wakeup_read, self._wakeup_write = os.pipe()
 		
-		self._load()
+		try:
+			flags = fcntl.fcntl(self._wakeup_write, fcntl.F_GETFL)
+			fcntl.fcntl(self._wakeup_write, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+			
+			self._load(offset)
+		except:
+			# Don't leak the descriptors opened so far
+			self._close()
+			raise
 	
 	def stop(self):
 		"""
 		Stops the tailer.
+		
+		This is safe to call from another thread: the iterator is woken
+		up immediately.
 		"""
 		
 		self._stop = True
+		
+		if self._closed:
+			# The descriptor might already belong to another file
+			return
+		
+		try:
+			os.write(self._wakeup_write, b"\0")
+		except OSError:
+			# Pipe full or already closed, the iterator is going away
+			# anyway
+			pass
+	
+	def _close(self):
+		"""
+		Releases the resources used by the tailer.
+		"""
+		
+		if self._closed:
+			return
+		
+		self._closed = True
+		
+		if self.file:
+			self.file.close()
+			self.file = None
+		
+		os.close(self._wakeup_read)
+		os.close(self._wakeup_write)
 	
-	def _load(self):
+	def _load(self, offset=0):
 		"""
 		Loads the file.
 		"""
@@ -67,9 +301,14 @@ class Follower:
 		if self.file:
 			self.file.close()
 		
-		self.file = open(self.path)
-		self.inode = os.stat(self.path).st_ino
-		self.position = 0
+		self.file = open(self.path, "rb")
+		self.inode = os.fstat(self.file.fileno()).st_ino
+		self.position = self.file.seek(offset)
+		
+		self.chunk_start = self.chunk_end = self.position
+		
+		# Invalid sequences shouldn't stop the tailer
+		self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
 	
 	def __iter__(self):
 		""""
@@ -83,29 +322,504 @@ class Follower:
 		Iterates over the file.
 		"""
 		
-		line = None
-		
-		while not line:
+		while True:
 			
 			if self._stop:
 				# Stop
-				self.file.close()
+				self._close()
 				raise StopIteration
 			
-			current_position = self.file.tell()
-			line = self.file.readline()
+			data = self.file.read(self.CHUNK_SIZE)
 			
-			if line:
-				return line
+			if data:
+				self.position += len(data)
+				
+				text = self.decoder.decode(data)
+				if text:
+					self.chunk_start = self.chunk_end
+					self.chunk_end = self.position - decoder_pending(self.decoder)
+					return text
+				
+				# Only a partial multibyte sequence, read again
+				continue
 			else:
-				# Check for rotation
+				# Check for rotation or truncation
 				try:
-					if os.stat(self.path).st_ino != self.inode:
+					stat = os.stat(self.path)
+					if stat.st_ino != self.inode or stat.st_size < self.position:
 						self._load()
 						continue
 				except FileNotFoundError:
 					# May happen during rotation
 					pass
 					
-				time.sleep(1)
-				self.file.seek(current_position)
+				self._wait()
+	
+	def _wait(self):
+		"""
+		Waits until the file might have changed, or until stop() has
+		been called.
+		
+		The default implementation simply waits for a second.
+		"""
+		
+		select.select([self._wakeup_read], [], [], 1)
+
+class InotifyFollower(Follower):
+	
+	"""
+	A Follower that waits for inotify events instead of polling the
+	file every second.
+	
+	The file is watched for modifications, moves and deletions, and
+	its parent directory for newly created files, so that rotations
+	are picked up as soon as they happen.
+	"""
+	
+	# Maximum time to wait for an event. It's only a safety net in case
+	# an event has been missed.
+	TIMEOUT = 30
+	
+	def __init__(self, path, offset=0):
+		"""
+		Initializes the class.
+		
+		`path` is the file path to open, `offset` is the byte offset
+		where to start reading from.
+		"""
+		
+		self.inotify_fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.inotify_fd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		
+		try:
+			self._add_watch(
+				os.path.dirname(os.path.abspath(path)),
+				IN_CREATE | IN_MOVED_TO
+			)
+		except OSError:
+			os.close(self.inotify_fd)
+			raise
+		
+		# Follower.__init__() calls _close() if it fails, so the inotify
+		# descriptor is released as well
+		super().__init__(path, offset)
+	
+	def _add_watch(self, path, mask):
+		"""
+		Adds an inotify watch on `path`.
+		"""
+		
+		if _libc.inotify_add_watch(self.inotify_fd, os.fsencode(path), mask) < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno), path)
+	
+	def _load(self, offset=0):
+		"""
+		Loads the file, and watches it.
+		"""
+		
+		super()._load(offset)
+		
+		# The watch on the old inode (if any) is dropped by the kernel
+		# once the file is deleted
+		self._add_watch(self.path, IN_MODIFY | IN_MOVE_SELF | IN_DELETE_SELF)
+	
+	def _drain(self):
+		"""
+		Discards the pending inotify events.
+		
+		We don't care about which event fired: the caller always re-reads
+		the file and checks for a rotation.
+		"""
+		
+		try:
+			while os.read(self.inotify_fd, 4096):
+				pass
+		except BlockingIOError:
+			pass
+	
+	def _wait(self):
+		"""
+		Waits for an inotify event.
+		"""
+		
+		readable, _w, _x = select.select(
+			[self.inotify_fd, self._wakeup_read],
+			[],
+			[],
+			self.TIMEOUT
+		)
+		
+		if self.inotify_fd in readable:
+			self._drain()
+	
+	def _close(self):
+		"""
+		Releases the resources used by the tailer.
+		"""
+		
+		if self._closed:
+			return
+		
+		super()._close()
+		
+		os.close(self.inotify_fd)
+
+def new_follower(path, offset=0):
+	"""
+	Returns a Follower for `path`, using inotify if it is available.
+	"""
+	
+	if INOTIFY_AVAILABLE:
+		try:
+			return InotifyFollower(path, offset)
+		except FileNotFoundError:
+			# Falling back wouldn't help
+			raise
+		except OSError:
+			# Too many watches, unsupported filesystem, ...
+			pass
+	
+	return Follower(path, offset)
+
+def decoder_pending(decoder):
+	"""
+	Returns the number of bytes an incremental decoder is holding back,
+	waiting for the rest of a multibyte sequence.
+	"""
+	
+	return len(decoder.getstate()[0])
+
+def read_mapped(path, offset=0, size=4 * 1024 * 1024):
+	"""
+	Reads a (completed) file through a memory mapping.
+	
+	This is a generator that yields (text, inode, start, end) tuples,
+	where text is a slice of at most `size` bytes decoded from UTF-8
+	(invalid sequences are replaced), and start and end are the byte
+	offsets of what it has been decoded from. Reading starts at `offset`.
+	
+	Reading stops if the file gets truncated in the meantime: touching
+	the mapping past the end of the file would raise SIGBUS.
+	"""
+	
+	with open(path, "rb") as f:
+		stat = os.fstat(f.fileno())
+		
+		if stat.st_size <= offset:
+			# Nothing to read (and empty files can't be mapped)
+			return
+		
+		with mmap.mmap(f.fileno(), stat.st_size, access=mmap.ACCESS_READ) as mapped:
+			decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+			decoded = offset
+			
+			for start in range(offset, stat.st_size, size):
+				end = min(start + size, stat.st_size)
+				
+				# The generator is resumed across main loop iterations,
+				# check that the file is still as large as the mapping
+				if os.fstat(f.fileno()).st_size < end:
+					return
+				
+				text = decoder.decode(mapped[start:end], end == stat.st_size)
+				
+				chunk_start, decoded = decoded, end - decoder_pending(decoder)
+				
+				yield (text, stat.st_ino, chunk_start, decoded)
+
+def split_tail(path, lines=0, max_bytes=0, batch_size=256 * 1024):
+	"""
+	Looks for the last `lines` lines of a file, but no more than
+	`max_bytes` bytes (0 means no limit).
+	
+	Returns a tuple with the byte offset where they start, and the list
+	of offsets that split what comes before in batches of roughly
+	`batch_size` bytes, oldest first. All offsets point to the start of a
+	line.
+	"""
+	
+	with open(path, "rb") as f:
+		size = os.fstat(f.fileno()).st_size
+		
+		if size == 0:
+			return 0, []
+		
+		with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+			
+			def line_start(position):
+				"""
+				Returns the offset of the line that contains `position`.
+				"""
+				
+				return mapped.rfind(b"\n", 0, position) + 1
+			
+			# Skip the trailing newline, if any
+			start = size - 1 if mapped[size - 1:size] == b"\n" else size
+			
+			if lines:
+				for line in range(lines):
+					start = mapped.rfind(b"\n", 0, start)
+					if start < 0:
+						break
+				start += 1
+			else:
+				start = 0
+			
+			if max_bytes and size - start > max_bytes:
+				start = mapped.find(b"\n", size - max_bytes) + 1 or size
+			
+			batches = []
+			position = start
+			while position > 0:
+				position = line_start(max(position - batch_size, 0))
+				batches.append(position)
+			batches.reverse()
+	
+	return start, batches
+
+class AsyncFollower:
+	
+	"""
+	An equivalent of tail -f that runs entirely on the GLib main loop.
+	
+	The file is read with Gio's asynchronous API, and a Gio.FileMonitor
+	tells when it grows or gets rotated, so no thread is needed.
+	
+	`callback` is called with every chunk of text read from the file,
+	the file inode and the byte offsets of what the chunk has been
+	decoded from (see Follower).
+	`done_callback`, if specified, is called with the follower as its only
+	argument once the reader has stopped: when stop() has been called or, if `follow` is
+	False, when the end of the file has been reached.
+	"""
+	
+	# Minimum interval between two change notifications, in milliseconds
+	rate_limit = 50
+	
+	def __init__(self, path, callback, follow=True, done_callback=None, offset=0):
+		"""
+		Initializes the class.
+		
+		`offset` is the byte offset where to start reading from. It's
+		ignored if the file gets rotated or truncated in the meantime.
+		"""
+		
+		self.path = path
+		self.file = Gio.File.new_for_path(path)
+		
+		self.callback = callback
+		self.done_callback = done_callback
+		self.follow = follow
+		
+		self.cancellable = Gio.Cancellable()
+		self.monitor = None
+		self.stream = None
+		
+		self.inode = None
+		self.position = 0
+		self.offset = offset
+		
+		# Byte offset right after the last chunk passed to the callback
+		self.chunk_end = 0
+		
+		# True if an asynchronous operation is ongoing
+		self.busy = False
+		
+		# Set when the file changes during an asynchronous operation
+		self.changed = False
+		self.rotated = False
+		
+		self.stopped = False
+	
+	def start(self):
+		"""
+		Starts reading.
+		"""
+		
+		if self.follow:
+			self.monitor = self.file.monitor_file(
+				Gio.FileMonitorFlags.NONE,
+				self.cancellable
+			)
+			# The default rate limit (800 ms) would make the output
+			# stutter
+			self.monitor.set_rate_limit(self.rate_limit)
+			self.monitor.connect("changed", self.on_file_changed)
+		
+		self._open()
+	
+	def stop(self):
+		"""
+		Stops the reader.
+		"""
+		
+		if self.stopped:
+			return
+		
+		self.stopped = True
+		self.cancellable.cancel()
+		
+		if self.monitor:
+			self.monitor.cancel()
+			self.monitor = None
+		
+		if not self.busy:
+			# Otherwise the pending operation will fail with CANCELLED
+			# and will do the cleanup
+			self._finish()
+	
+	def _finish(self):
+		"""
+		Closes the stream and notifies the caller.
+		"""
+		
+		self.stopped = True
+		
+		if self.monitor:
+			self.monitor.cancel()
+			self.monitor = None
+		
+		if self.stream:
+			self.stream.close(None)
+			self.stream = None
+		
+		if self.done_callback:
+			self.done_callback(self)
+	
+	def _open(self):
+		"""
+		Opens the file.
+		"""
+		
+		if self.stream:
+			self.stream.close(None)
+			self.stream = None
+		
+		self.busy = True
+		self.rotated = False
+		self.file.read_async(
+			GLib.PRIORITY_DEFAULT,
+			self.cancellable,
+			self.on_file_read
+		)
+	
+	def _read_line(self):
+		"""
+		Reads the next line.
+		"""
+		
+		self.busy = True
+		self.changed = False
+		self.stream.read_line_async(
+			GLib.PRIORITY_DEFAULT,
+			self.cancellable,
+			self.on_line_read
+		)
+	
+	def on_file_read(self, file, result):
+		"""
+		Fired when the file has been opened.
+		"""
+		
+		self.busy = False
+		
+		try:
+			stream = file.read_finish(result)
+		except GLib.Error as e:
+			if self.follow and not self.stopped and e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.NOT_FOUND):
+				# Not yet created, the monitor will tell us when it is
+				return
+			
+			self._finish()
+			return
+		
+		info = stream.query_info("unix::inode,standard::size", None)
+		self.inode = info.get_attribute_uint64("unix::inode")
+		self.position = 0
+		
+		# Honour the requested offset only once, and only if it's still
+		# inside the file
+		if 0 < self.offset <= info.get_size():
+			stream.seek(self.offset, GLib.SeekType.SET, None)
+			self.position = self.offset
+		self.offset = 0
+		self.chunk_end = self.position
+		
+		self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+		
+		self.stream = Gio.DataInputStream.new(stream)
+		self._read_line()
+	
+	def on_line_read(self, stream, result):
+		"""
+		Fired when a line has been read.
+		"""
+		
+		self.busy = False
+		
+		try:
+			line, length = stream.read_line_finish(result)
+		except GLib.Error:
+			# Cancelled or I/O error
+			self._finish()
+			return
+		
+		if line is not None:
+			# read_line() strips the newline, unless the line hasn't
+			# been terminated yet: look at how much we consumed
+			# to see if it had one.
+			position = stream.tell()
+			if position - self.position > length:
+				line += b"\n"
+			self.position = position
+			
+			text = self.decoder.decode(line)
+			if text:
+				start, self.chunk_end = self.chunk_end, self.position - decoder_pending(self.decoder)
+				self.callback(text, self.inode, start, self.chunk_end)
+			
+			self._read_line()
+		elif not self.follow:
+			# Everything has been read
+			self._finish()
+		elif self.rotated or self._truncated():
+			# The old file has been drained, move on to the new one
+			self._open()
+		elif self.changed:
+			self._read_line()
+	
+	def _truncated(self):
+		"""
+		Returns True if the file is now shorter than what has been read.
+		"""
+		
+		try:
+			return os.stat(self.path).st_size < self.position
+		except OSError:
+			# Being rotated
+			return False
+	
+	def on_file_changed(self, monitor, file, other_file, event):
+		"""
+		Fired when the file monitor reports a change.
+		"""
+		
+		if event == Gio.FileMonitorEvent.CREATED:
+			# Created or rotated
+			self.rotated = True
+		elif event in (Gio.FileMonitorEvent.CHANGED, Gio.FileMonitorEvent.CHANGES_DONE_HINT):
+			self.changed = True
+		else:
+			return
+		
+		if self.busy:
+			# Will be handled once the current operation completes
+			return
+		
+		if self.rotated or not self.stream:
+			self._open()
+		else:
+			self._read_line()
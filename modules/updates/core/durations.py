@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Authors:
+#    Eugenio "g7" Paolantonio <me@medesimo.eu>
+#
+
+import os
+
+from gi.repository import GLib
+
+class DurationStore:
+	
+	"""
+	Remembers how long it took to unpack and configure every package.
+	
+	The durations are kept in an append-only file, one
+	"name<TAB>unpack<TAB>configure" line per sample, and are loaded
+	in a dictionary the first time they are needed. Repeated samples
+	of the same package are merged with an exponentially weighted
+	moving average.
+	"""
+	
+	# Weight of the newest sample when merging
+	WEIGHT = 0.5
+	
+	# Durations used for packages we don't know about, if there are no
+	# samples at all
+	DEFAULT_DURATIONS = (2.5, 2.5)
+	
+	def __init__(self, path=None):
+		"""
+		Initializes the class.
+		
+		`path` is the file where the durations are stored.
+		"""
+		
+		self.path = path or os.path.join(
+			GLib.get_user_cache_dir(),
+			"vera-control-center",
+			"updates-durations"
+		)
+		
+		# name -> [unpack, configure], loaded lazily
+		self.durations = None
+		self.mean = self.DEFAULT_DURATIONS
+		
+		# Number of lines in the file
+		self.lines = 0
+	
+	def load(self):
+		"""
+		Loads the durations, if they haven't been loaded yet.
+		"""
+		
+		if self.durations is not None:
+			return
+		
+		self.durations = {}
+		
+		try:
+			with open(self.path) as f:
+				for line in f:
+					self.lines += 1
+					
+					try:
+						name, unpack, configure = line.rstrip("\n").split("\t")
+						self._merge(name, float(unpack), float(configure))
+					except ValueError:
+						# Corrupted line
+						continue
+		except OSError:
+			pass
+		
+		self._update_mean()
+	
+	def _merge(self, name, unpack, configure):
+		"""
+		Merges a sample.
+		"""
+		
+		previous = self.durations.get(name)
+		
+		if previous is None:
+			self.durations[name] = [unpack, configure]
+		else:
+			previous[0] += (unpack - previous[0]) * self.WEIGHT
+			previous[1] += (configure - previous[1]) * self.WEIGHT
+	
+	def _update_mean(self):
+		"""
+		Updates the duration used for unknown packages.
+		"""
+		
+		if self.durations:
+			self.mean = (
+				sum(unpack for unpack, configure in self.durations.values()) / len(self.durations),
+				sum(configure for unpack, configure in self.durations.values()) / len(self.durations)
+			)
+		else:
+			self.mean = self.DEFAULT_DURATIONS
+	
+	def get(self, name):
+		"""
+		Returns the expected time needed to unpack and to configure the
+		package `name`, as an (unpack, configure) tuple, in seconds.
+		"""
+		
+		self.load()
+		
+		durations = self.durations.get(name)
+		if durations is None:
+			return self.mean
+		
+		return tuple(durations)
+	
+	def record(self, samples):
+		"""
+		Stores new samples.
+		
+		`samples` is an iterable of (name, unpack, configure) tuples.
+		"""
+		
+		self.load()
+		
+		lines = []
+		for name, unpack, configure in samples:
+			self._merge(name, unpack, configure)
+			lines.append("%s\t%.3f\t%.3f\n" % (name, unpack, configure))
+		
+		if not lines:
+			return
+		
+		self._update_mean()
+		
+		try:
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+			
+			if self.lines + len(lines) > 4 * len(self.durations):
+				# Mostly superseded samples, rewrite the file with the
+				# merged ones
+				lines = [
+					"%s\t%.3f\t%.3f\n" % (name, unpack, configure)
+					for name, (unpack, configure) in self.durations.items()
+				]
+				mode = "w"
+				self.lines = 0
+			else:
+				mode = "a"
+			
+			with open(self.path, mode) as f:
+				f.writelines(lines)
+			
+			self.lines += len(lines)
+		except OSError:
+			# Not a big deal, we'll just have a worse estimate
+			pass
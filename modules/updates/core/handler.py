@@ -23,7 +23,188 @@ import os
 
 from gi.repository import GObject, GLib, Gio
 
+from .bus import get_proxy
+from .common import parse_size, format_size, format_duration, RateEstimator
+from .durations import DurationStore
+
 IFACE = "org.semplicelinux.channels.updates"
+UPDATES_PATH = "/org/semplicelinux/channels/updates"
+
+# GObject properties mirroring a DBus property of the updates object
+DBUS_PROPERTIES = {
+	"refreshing" : "Refreshing",
+	"downloading" : "Downloading",
+	"cache-opening" : "CacheOpening",
+	"checking" : "Checking",
+	"installing" : "Installing",
+	"cache-failure" : "CacheFailure",
+}
+
+# Properties computed from the DBus properties
+DERIVED_PROPERTIES = (
+	"cache-operation",
+	"download-operation",
+	"download-operation-label",
+	"install-operation-label",
+)
+
+# How every state signal changes the DBus properties: it maps the signal
+# to the values it implies, and to the properties it may have changed
+# in a way we can't tell (they will be fetched again when needed).
+STATE_SIGNALS = {
+	"CacheUpdateStarted" : ({"Refreshing" : True}, ("CacheFailure",)),
+	"CacheUpdateStopped" : ({"Refreshing" : False}, ("CacheFailure",)),
+	"CacheOpenProgress" : ({"CacheOpening" : True}, ()),
+	"CacheOpenDone" : ({"CacheOpening" : False}, ("CacheFailure",)),
+	"UpdateCheckStarted" : ({"Checking" : True}, ("CacheFailure",)),
+	"UpdateCheckFailed" : ({"Checking" : False}, ("CacheFailure",)),
+	"UpdateCheckStopped" : ({"Checking" : False}, ("CacheFailure",)),
+	"PackageAcquireStarted" : ({"Downloading" : True}, ()),
+	"PackageAcquireStopped" : ({"Downloading" : False}, ()),
+	"PackageInstallStarted" : ({"Installing" : True}, ()),
+	"PackageInstallFinished" : ({"Installing" : False}, ()),
+	"PackageInstallFailed" : ({"Installing" : False}, ()),
+}
+
+# The properties the scene reacts to, for every DBus property. A change
+# of the latter always gets them notified, even if it has been reverted
+# before the notifications went out (see flush_notify()).
+STATE_PROPERTIES = {
+	"Refreshing" : ("refreshing", "cache-operation"),
+	"CacheOpening" : ("cache-operation",),
+	"Checking" : ("checking", "cache-operation"),
+	"Installing" : ("installing",),
+	# on_cache_operation_changed() reads it: notifying cache-failure
+	# itself would fetch it again right away
+	"CacheFailure" : ("cache-operation",),
+}
+
+# How every DBus signal is handled: a tuple with the GObject properties
+# to notify, the GObject signal to relay it to (with the same
+# parameters) and the UpdateHandler method to call with its parameters.
+SIGNALS = {
+	"UpdateFound" : (
+		(),
+		"update-found",
+		"on_update_found"
+	),
+	"PackageStatusChanged" : (
+		(),
+		"package-status-changed",
+		"on_package_status_changed"
+	),
+	"CacheUpdateStarted" : (
+		("refreshing", "cache-operation", "download-operation"),
+		None,
+		None
+	),
+	"CacheUpdateStopped" : (
+		("refreshing", "cache-operation", "download-operation"),
+		None,
+		"stop_download_rate"
+	),
+	"CacheOpenProgress" : (
+		("cache-opening", "cache-operation"),
+		None,
+		None
+	),
+	"CacheOpenDone" : (
+		("cache-opening", "cache-operation"),
+		None,
+		None
+	),
+	"UpdateCheckStarted" : (
+		("checking", "cache-operation"),
+		None,
+		"on_update_check_started"
+	),
+	"UpdateCheckFailed" : (
+		("checking", "cache-operation"),
+		"update-check-failed",
+		None
+	),
+	"UpdateCheckStopped" : (
+		(
+			"checking",
+			"cache-operation",
+			"install-operation-label" # FIXME
+		),
+		None,
+		"on_update_check_stopped"
+	),
+	"PackageAcquireStarted" : (
+		(
+			"downloading",
+			"download-operation",
+			"download-completed",
+			"download-operation-label",
+			"install-operation-label"
+		),
+		None,
+		"on_acquire_started"
+	),
+	"PackageAcquireStopped" : (
+		(
+			"downloading",
+			"download-operation",
+			"download-completed",
+			"download-operation-label",
+			"install-operation-label"
+		),
+		None,
+		"stop_download_rate"
+	),
+	"CacheUpdateItemFetch" : (
+		(),
+		None,
+		"on_item_fetch"
+	),
+	"PackageAcquireItemFetch" : (
+		(),
+		"package-fetch-started",
+		"on_acquire_item_fetch"
+	),
+	"PackageAcquireItemFailed" : (
+		(),
+		"package-fetch-failed",
+		"on_acquire_item_failed"
+	),
+	"PackageAcquireItemDone" : (
+		(),
+		"package-fetch-finished",
+		"on_acquire_item_done"
+	),
+	"PackageInstallProgressChanged" : (
+		("install-eta",),
+		None,
+		"on_install_progress_changed"
+	),
+	"PackageInstallStarted" : (
+		("installing",),
+		None,
+		"on_install_started"
+	),
+	"PackageInstallFinished" : (
+		("installing", "install-eta"),
+		None,
+		"on_install_finished"
+	),
+	"PackageInstallFailed" : (
+		("installing", "install-eta"),
+		None,
+		"on_install_failed"
+	),
+	"LockFailed" : (
+		(),
+		None,
+		"on_lock_failed"
+	),
+	"GenericFailure" : (
+		(),
+		"generic-failure",
+		None
+	),
+}
 
 class UpdateHandler(GObject.Object):
 	
@@ -160,6 +341,15 @@ class UpdateHandler(GObject.Object):
 			"",
 			GObject.PARAM_READWRITE
 		),
+		"update-required-download-bytes" : (
+			GObject.TYPE_INT64,
+			"Update download size in bytes",
+			"The update download size in bytes, -1 if unknown.",
+			-1,
+			GLib.MAXINT64,
+			-1,
+			GObject.PARAM_READABLE
+		),
 		"install-progress" : (
 			GObject.TYPE_FLOAT,
 			"Installation progress",
@@ -169,6 +359,22 @@ class UpdateHandler(GObject.Object):
 			0.0,
 			GObject.PARAM_READWRITE
 		),
+		"install-eta" : (
+			GObject.TYPE_INT,
+			"Installation ETA",
+			"The estimated number of seconds left to complete the installation, -1 if unknown.",
+			-1,
+			GLib.MAXINT32,
+			-1,
+			GObject.PARAM_READABLE
+		),
+		"connected" : (
+			GObject.TYPE_BOOLEAN,
+			"Connected",
+			"True if the handler is connected to channels, False if it's still connecting.",
+			False,
+			GObject.PARAM_READABLE
+		),
 	}
 	
 	__gsignals__ = {
@@ -177,6 +383,11 @@ class UpdateHandler(GObject.Object):
 			None,
 			(int, str, str, str, bool, str)
 		),
+		"updates-found" : (
+			GObject.SIGNAL_RUN_FIRST,
+			None,
+			(GObject.TYPE_PYOBJECT,)
+		),
 		"lock-failed" : (
 			GObject.SIGNAL_RUN_FIRST,
 			None,
@@ -192,6 +403,16 @@ class UpdateHandler(GObject.Object):
 			None,
 			()
 		),
+		"update-check-stopped" : (
+			GObject.SIGNAL_RUN_FIRST,
+			None,
+			()
+		),
+		"service-restarted" : (
+			GObject.SIGNAL_RUN_FIRST,
+			None,
+			()
+		),
 		"package-status-changed" : (
 			GObject.SIGNAL_RUN_FIRST,
 			None,
@@ -231,6 +452,41 @@ class UpdateHandler(GObject.Object):
 	
 	download_rate_timeout = 0
 	
+	# While downloading packages, the download rate and ETA are
+	# estimated locally from the size of the packages downloaded so
+	# far, and updated every download_rate_interval milliseconds. The
+	# rate averages the samples of the last download_rate_window
+	# seconds or so, and is held between two completed packages for
+	# download_rate_stale_after seconds at most.
+	# channels is polled every download_rate_poll_interval seconds
+	# only when the estimate is not available (e.g. while refreshing
+	# the cache, before the first package has been downloaded, or
+	# while a large one is).
+	download_rate_interval = 500
+	download_rate_window = 5.0
+	download_rate_stale_after = 10.0
+	download_rate_poll_interval = 2
+	
+	# Timeout of the DBus method calls, in milliseconds. -1 means the
+	# GDBus default. call_timeouts overrides it for specific methods.
+	default_call_timeout = -1
+	call_timeouts = {}
+	
+	# The updates found are emitted in batches (see updates-found) of
+	# at most update_batch_size updates, at most update_batch_delay
+	# milliseconds after the first one has been found.
+	update_batch_size = 500
+	update_batch_delay = 100
+	
+	# Status changes are sent change_status_delay milliseconds after
+	# the first one has been requested, so that a burst of them (e.g.
+	# when a whole section gets toggled) is sent at once.
+	change_status_delay = 150
+	
+	# The download size is fetched again at most once every
+	# download_size_delay milliseconds
+	download_size_delay = 300
+	
 	def __init__(self):
 		"""
 		Initializes the class.
@@ -242,170 +498,901 @@ class UpdateHandler(GObject.Object):
 		self.signal_handlers = {
 		}
 		
-		# Connect to the object
-		self.bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
-		self.Updates = Gio.DBusProxy.new_sync(
-			self.bus,
-			Gio.DBusProxyFlags.DO_NOT_AUTO_START_AT_CONSTRUCTION,
-			None,
-			"org.semplicelinux.channels",
-			"/org/semplicelinux/channels/updates",
+		# id -> [name, selected] of the updates found by the last check
+		self.found_updates = {}
+		
+		# name -> size in bytes of the updates found, and
+		# transaction id -> size of the packages being downloaded
+		self.update_sizes = {}
+		self.transaction_sizes = {}
+		self.download_estimator = RateEstimator(
+			self.download_rate_window,
+			self.download_rate_stale_after
+		)
+		self.download_rate_polled = 0
+		
+		# Updates not yet emitted through updates-found
+		self.update_batch = []
+		self.update_batch_timeout = 0
+		
+		# id -> reason of the status changes not yet sent
+		self.pending_status = {}
+		self.change_status_timeout = 0
+		
+		# id -> selected state of the last status change sent, that
+		# might not have been confirmed by channels yet
+		self.sent_status = {}
+		
+		self.download_size_timeout = 0
+		
+		# Cached reply of GetUpdateInfos, and the download size in
+		# bytes. They are fetched again (without blocking) only when
+		# something that may have changed them happened.
+		self.update_infos = None
+		self.download_size = -1
+		self.update_infos_pending = False
+		self.update_infos_stale = False
+		
+		# Past installation durations, and the expected [unpack,
+		# configure] durations of every package still to be installed
+		self.durations = DurationStore()
+		self.install_pending = {}
+		self.install_eta = 0.0
+		
+		# Used to cancel the pending method calls
+		self.cancellable = Gio.Cancellable()
+		
+		# Properties to be notified at the end of the current main loop
+		# iteration, see queue_notify()
+		self.dirty_properties = set()
+		self.notify_source = 0
+		
+		# Properties to be notified even if their value didn't change,
+		# as it did in the meantime (e.g. refreshing going True and
+		# then False in the same iteration)
+		self.forced_properties = set()
+		
+		# Last value notified for every property, and how many
+		# notifications have been emitted or suppressed because the
+		# value didn't change
+		self.published = {}
+		self.notifications_emitted = 0
+		self.notifications_suppressed = 0
+		
+		# Local mirror of the DBus properties, so that reading a property
+		# doesn't need a round trip. It's seeded with the properties the
+		# proxy got at construction time (via GetAll), and kept up to date
+		# by PropertiesChanged and by the state signals.
+		self.dbus_properties = {}
+		
+		# Handle cache-operation state
+		self.connect("notify::cache-operation", self.on_cache_operation_changed)
+		self.connect("notify::cache-failure", self.on_cache_operation_changed)
+		
+		# Connect to the object. The proxies (and then the properties)
+		# are loaded without blocking, and the method calls made in the
+		# meantime are sent once everything is ready (see
+		# on_dbus_properties_loaded()). bus is set at that point.
+		self.bus = None
+		self.Updates = None
+		self.Properties = None
+		self.pending_calls = []
+		self.connection_failed = False
+		
+		# True once channels has been seen running
+		self.name_owner_seen = False
+		
+		get_proxy(
+			UPDATES_PATH,
 			IFACE,
-			None
+			self.on_updates_proxy_ready,
+			Gio.DBusProxyFlags.DO_NOT_AUTO_START_AT_CONSTRUCTION
 		)
-		self.Properties = Gio.DBusProxy.new_sync(
-			self.bus,
-			Gio.DBusProxyFlags.DO_NOT_AUTO_START_AT_CONSTRUCTION,
-			None,
-			"org.semplicelinux.channels",
-			"/org/semplicelinux/channels/updates",
+		get_proxy(
+			UPDATES_PATH,
 			"org.freedesktop.DBus.Properties",
-			None
+			self.on_properties_proxy_ready,
+			Gio.DBusProxyFlags.DO_NOT_AUTO_START_AT_CONSTRUCTION
 		)
+	
+	def on_updates_proxy_ready(self, proxy):
+		"""
+		Fired when the proxy for channels' updates object is ready.
+		"""
+		
+		self.Updates = proxy
+		self.on_proxy_ready(proxy)
+	
+	def on_properties_proxy_ready(self, proxy):
+		"""
+		Fired when the proxy for the updates object properties is ready.
+		"""
+		
+		self.Properties = proxy
+		self.on_proxy_ready(proxy)
+	
+	def on_proxy_ready(self, proxy):
+		"""
+		Completes the connection once every proxy is ready.
+		"""
+		
+		if proxy is None:
+			# Both proxies fail when the bus is unreachable, report it
+			# only once
+			if not self.connection_failed:
+				self.connection_failed = True
+				self.emit(
+					"generic-failure",
+					_("Unable to communicate with the update service"),
+					_("Unable to connect to channels.")
+				)
+			return
+		
+		if self.Updates is None or self.Properties is None:
+			return
 		
 		# Handle DBus signals
 		self.Updates.connect("g-signal", self.on_dbus_signal_changed)
+		self.Updates.connect("g-properties-changed", self.on_dbus_properties_changed)
 		
-		# Handle cache-operation state
-		self.connect("notify::cache-operation", self.on_cache_operation_changed)
+		# Handle channels restarts. Its first activation (e.g. by
+		# load_dbus_properties()) is not a restart.
+		self.name_owner_seen = (self.Updates.get_name_owner() is not None)
+		self.Updates.connect("notify::g-name-owner", self.on_name_owner_changed)
+		
+		# The connection is completed once the properties are there
+		self.load_dbus_properties()
+	
+	def on_dbus_properties_loaded(self, properties):
+		"""
+		Completes the connection, once the DBus `properties` have been
+		loaded.
+		"""
+		
+		# Until now, get_dbus_property() returned False for everything
+		# and that's what has been seen by the bindings and by whoever
+		# read them: only notify what differs, so that the handlers of
+		# the other properties don't run twice (e.g. the scene would
+		# check for updates both when connected and when refreshing
+		# gets notified)
+		for name in DBUS_PROPERTIES:
+			self.published.setdefault(name, False)
+		
+		self.dbus_properties = properties
+		self.bus = self.Updates.get_connection()
+		
+		# Send what has been requested in the meantime
+		calls, self.pending_calls = self.pending_calls, []
+		for args, kwargs in calls:
+			self.call(*args, **kwargs)
+		
+		self.queue_notify("connected", *DBUS_PROPERTIES)
+		self.queue_notify(*DERIVED_PROPERTIES)
+	
+	def call(self, method, signature=None, *args, callback=None, error_callback=None, timeout=None):
+		"""
+		Calls `method` on channels' updates object, without blocking.
+		
+		`signature` and `args` are the call parameters. `callback`, if
+		specified, is called with the unpacked return values once the call
+		completes. Failures are reported to `error_callback` (if
+		specified) with the error, and through the generic-failure signal
+		unless `error_callback` returns True.
+		
+		`timeout` overrides call_timeouts and default_call_timeout.
+		
+		Calls made before the handler is connected are queued.
+		"""
+		
+		if not self.props.connected:
+			self.pending_calls.append(
+				(
+					(method, signature) + args,
+					{
+						"callback" : callback,
+						"error_callback" : error_callback,
+						"timeout" : timeout
+					}
+				)
+			)
+			return
+		
+		if timeout is None:
+			timeout = self.call_timeouts.get(method, self.default_call_timeout)
+		
+		self.Updates.call(
+			method,
+			GLib.Variant(signature, args) if signature else None,
+			Gio.DBusCallFlags.NONE,
+			timeout,
+			self.cancellable,
+			self.on_call_finished,
+			(method, callback, error_callback)
+		)
+	
+	def on_call_finished(self, proxy, result, data):
+		"""
+		Fired when a method call started by call() completed.
+		"""
+		
+		method, callback, error_callback = data
+		
+		try:
+			value = proxy.call_finish(result)
+		except GLib.Error as e:
+			if error_callback and error_callback(e):
+				# Already taken care of
+				return
+			
+			if not e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+				self.emit(
+					"generic-failure",
+					_("Unable to communicate with the update service"),
+					e.message
+				)
+			return
+		
+		if callback:
+			callback(*value.unpack())
+	
+	def cancel(self):
+		"""
+		Cancels the pending method calls.
+		"""
+		
+		self.cancellable.cancel()
+		self.cancellable = Gio.Cancellable()
 	
 	def refresh(self):
 		"""
 		Refreshes the cache.
 		"""
 		
-		self.Updates.Refresh()
+		self.call("Refresh")
 	
 	def fetch(self, trigger_installation=False):
 		"""
 		Fetches the packages.
 		"""
 		
+		# Status changes must get there first
+		self.flush_status_changes()
+		
 		if not trigger_installation:
-			self.Updates.Fetch()
+			self.call("Fetch")
 		else:
-			self.Updates.FetchInstall('(s)', os.environ["DISPLAY"])
+			self.call("FetchInstall", "(s)", os.environ["DISPLAY"])
 	
 	def fetch_stop(self):
 		"""
 		Stops the package fetching.
 		"""
 		
-		self.Updates.FetchStop()
+		self.call("FetchStop")
 	
 	def check(self, force=False):
 		"""
 		Checks for updates.
 		"""
 		
-		self.Updates.CheckUpdates("(bb)", True, force) # FIXME: Handle stable
+		self.call("CheckUpdates", "(bb)", True, force) # FIXME: Handle stable
 	
 	def change_status(self, id, reason):
 		"""
 		Changes the status of a package.
+		
+		The change is sent with the other ones requested in the next
+		change_status_delay milliseconds. Only the last one requested
+		for every package is sent.
 		"""
 		
-		self.Updates.ChangeStatus("(is)", id, reason)
+		self.pending_status[id] = reason
+		
+		if self.change_status_timeout == 0:
+			self.change_status_timeout = GLib.timeout_add(
+				self.change_status_delay,
+				self.flush_status_changes
+			)
 	
-	def update_download_rate(self):
+	def flush_status_changes(self):
 		"""
-		Updates the refresh-rate property.
+		Sends the pending status changes.
 		"""
-				
-		self.set_property("download-rate", self.Properties.Get("(ss)", IFACE, "CurrentDownloadRate"))
-		self.set_property("download-eta", self.Properties.Get("(ss)", IFACE, "CurrentDownloadETA"))
 		
-		return True
+		if self.change_status_timeout > 0:
+			GLib.source_remove(self.change_status_timeout)
+			self.change_status_timeout = 0
+		
+		changes, self.pending_status = self.pending_status, {}
+		
+		# Failures are reported once per batch, as a section toggle
+		# sends a change for every package in it
+		failures = []
+		
+		def on_failure(id, error):
+			"""
+			Fired when a status change of the batch failed.
+			"""
+			
+			# Not sent after all
+			self.sent_status.pop(id, None)
+			
+			failures.append(error)
+			
+			return len(failures) > 1
+		
+		for id, reason in changes.items():
+			selected = (reason != "keep")
+			
+			if id in self.sent_status:
+				current = self.sent_status[id]
+			elif id in self.found_updates:
+				current = self.found_updates[id][1]
+			else:
+				current = None
+			
+			if selected == current:
+				# Toggled back, nothing to do
+				continue
+			
+			self.sent_status[id] = selected
+			self.call(
+				"ChangeStatus",
+				"(is)",
+				id,
+				reason,
+				error_callback=lambda error, id=id: on_failure(id, error)
+			)
+		
+		return False
 	
-	def on_dbus_signal_changed(self, proxy, sender, signal, params):
+	def queue_download_size_refresh(self, *params):
 		"""
-		Handles DBus signals.
+		Schedules a refresh of the update-required-download property
+		(and of the ones depending on it).
 		"""
 		
-		if signal in self.signal_handlers:
-			self.signal_handlers[signal](*params)
-		elif signal == "UpdateFound":
-			# Package update found!
-			self.emit("update-found", *params)
-		elif signal == "PackageStatusChanged":
-			# Package status changed!
-			self.emit("package-status-changed", *params)
-			
-			# Update required download size
-			self.notify("update-required-download")
-		elif signal in ("CacheUpdateStarted", "CacheUpdateStopped"):
-			# Send notification on refreshing property
-			self.notify("refreshing")
-			self.notify("cache-operation")
-			self.notify("download-operation")
-		elif signal in ("CacheOpenProgress", "CacheOpenDone"):
-			# Send notification in cache_opening property
-			self.notify("cache-opening")
-			self.notify("cache-operation")
-		elif signal in ("UpdateCheckStarted", "UpdateCheckFailed", "UpdateCheckStopped"):
-			# Send notification on checking and cache-opening properties
-			self.notify("checking")
-			self.notify("cache-operation")
-			
-			# Get update infos if the check has been completed
-			if signal == "UpdateCheckStopped":
-				self.notify("update-required-download")
-				self.notify("download-completed")
-				self.notify("install-operation-label") # FIXME
-		elif signal in ("PackageAcquireStarted", "PackageAcquireStopped"):
-			# Send notification on downloading property
-			self.notify("downloading")
-			self.notify("download-operation")
-			self.notify("download-completed")
+		if self.download_size_timeout == 0:
+			self.download_size_timeout = GLib.timeout_add(
+				self.download_size_delay,
+				self.on_download_size_timeout
+			)
+	
+	def on_download_size_timeout(self):
+		"""
+		Refreshes the update-required-download property.
+		"""
+		
+		self.download_size_timeout = 0
+		
+		self.invalidate_update_infos()
+		
+		return False
+	
+	def invalidate_update_infos(self):
+		"""
+		Fetches the update infos again. The properties depending on them
+		are notified once the reply arrives.
+		"""
+		
+		if self.update_infos_pending:
+			# Fetch them again once the current call completes
+			self.update_infos_stale = True
+			return
+		
+		self.update_infos_pending = True
+		self.call(
+			"GetUpdateInfos",
+			callback=self.on_update_infos,
+			error_callback=self.on_update_infos_failed
+		)
+	
+	def on_update_infos(self, *infos):
+		"""
+		Fired when GetUpdateInfos replied.
+		"""
+		
+		self.update_infos_pending = False
+		
+		# Single out arguments come unpacked, as with the proxy sugar
+		if len(infos) == 1:
+			infos = infos[0]
+		
+		self.update_infos = infos
+		self.download_size = parse_size(infos[0])
+		
+		self.queue_notify(
+			"update-required-download",
+			"update-required-download-bytes",
+			"download-completed",
+			"install-operation-label"
+		)
+		
+		if self.update_infos_stale:
+			self.update_infos_stale = False
+			self.invalidate_update_infos()
+	
+	def on_update_infos_failed(self, error):
+		"""
+		Fired when GetUpdateInfos failed.
+		"""
+		
+		self.update_infos_pending = self.update_infos_stale = False
+	
+	def get_update_infos(self):
+		"""
+		Returns the cached update infos, or None if they haven't been
+		fetched yet (in that case they are requested).
+		"""
+		
+		if self.update_infos is None and not self.update_infos_pending:
+			self.invalidate_update_infos()
+		
+		return self.update_infos
+	
+	def start_install_eta(self):
+		"""
+		Estimates the duration of the installation that is starting.
+		"""
+		
+		self.install_pending = {}
+		self.install_eta = 0.0
+		
+		for name, selected in self.found_updates.values():
+			if selected:
+				self.install_pending[name] = list(self.durations.get(name))
+				self.install_eta += sum(self.install_pending[name])
+		
+		self.queue_notify("install-eta")
+	
+	def package_unpacked(self, name):
+		"""
+		Tells the handler that the package `name` has been unpacked, to
+		update the install-eta property.
+		
+		apt unpacks every package before configuring them, so the
+		unpack stage of a package is all that's done until much later.
+		"""
+		
+		durations = self.install_pending.get(name)
+		if durations is not None and durations[0] > 0:
+			self.install_eta -= durations[0]
+			durations[0] = 0
+			self.queue_notify("install-eta")
+	
+	def package_completed(self, name):
+		"""
+		Tells the handler that the package `name` has been installed
+		(or removed), to update the install-eta property.
+		"""
+		
+		if name in self.install_pending:
+			self.install_eta -= sum(self.install_pending.pop(name))
+			self.queue_notify("install-eta")
+	
+	def load_dbus_properties(self):
+		"""
+		Loads the DBus property mirror, without blocking.
+		"""
+		
+		names = self.Updates.get_cached_property_names()
+		if names:
+			self.on_dbus_properties_loaded({
+				name : self.Updates.get_cached_property(name).unpack()
+				for name in names
+			})
+		else:
+			# The proxy didn't load them (e.g. channels wasn't running
+			# at the time), ask for everything at once
+			self.Properties.call(
+				"GetAll",
+				GLib.Variant("(s)", (IFACE,)),
+				Gio.DBusCallFlags.NONE,
+				self.default_call_timeout,
+				self.cancellable,
+				self.on_get_all_finished,
+				None
+			)
+	
+	def on_get_all_finished(self, proxy, result, data):
+		"""
+		Fired when the properties requested by load_dbus_properties()
+		have been read.
+		"""
+		
+		try:
+			properties = proxy.call_finish(result).unpack()[0]
+		except GLib.Error:
+			# Will be fetched one by one when needed
+			properties = {}
+		
+		self.on_dbus_properties_loaded(properties)
+	
+	def on_name_owner_changed(self, proxy, param):
+		"""
+		Fired when channels went away or came back.
+		"""
+		
+		if proxy.get_name_owner() is None:
+			# Nothing is going on anymore
+			self.stop_download_rate()
+			self.dbus_properties = {
+				name : False
+				for name in DBUS_PROPERTIES.values()
+			}
 			
-			self.notify("download-operation-label")
-			self.notify("install-operation-label")
-		elif signal in ("CacheUpdateItemFetch", "PackageAcquireItemFetch"):
-			self.set_property("download-current-item", params[1])
+			self.queue_notify(*DBUS_PROPERTIES)
+			self.queue_notify(*DERIVED_PROPERTIES)
+		elif not self.name_owner_seen:
+			# Activated for the first time, nothing to resynchronize
+			self.name_owner_seen = True
+		else:
+			# Read everything again in one call
+			self.Properties.call(
+				"GetAll",
+				GLib.Variant("(s)", (IFACE,)),
+				Gio.DBusCallFlags.NONE,
+				self.default_call_timeout,
+				self.cancellable,
+				self.on_service_restarted,
+				None
+			)
+	
+	def on_service_restarted(self, proxy, result, data):
+		"""
+		Fired when the properties of the restarted channels have been
+		read.
+		"""
+		
+		try:
+			self.dbus_properties = proxy.call_finish(result).unpack()[0]
+		except GLib.Error:
+			# Will be fetched one by one when needed
+			self.dbus_properties = {}
+		
+		self.queue_notify(*DBUS_PROPERTIES)
+		self.queue_notify(*DERIVED_PROPERTIES)
+		
+		self.update_infos = None
+		self.invalidate_update_infos()
+		
+		self.emit("service-restarted")
+	
+	def get_dbus_property(self, name):
+		"""
+		Returns the value of the DBus property `name`, fetching it only
+		if it's not in the mirror.
+		"""
+		
+		if not name in self.dbus_properties:
+			if not self.props.connected:
+				# Every mirrored property is a boolean, and nothing is
+				# going on as far as we know
+				return False
 			
-			# Fire package-fetch-started if PackageAcquireItemFetch
-			if signal == "PackageAcquireItemFetch":
-				self.emit("package-fetch-started", *params)
-		elif signal == "PackageAcquireItemFailed":
-			# Package fetching failed
-			self.emit("package-fetch-failed", *params)
-		elif signal == "PackageAcquireItemDone":
-			# Package fetching finished
-			self.emit("package-fetch-finished", *params)
+			self.dbus_properties[name] = self.Properties.Get("(ss)", IFACE, name)
+		
+		return self.dbus_properties[name]
+	
+	def update_dbus_properties(self, values, invalidated):
+		"""
+		Updates the property mirror with `values`, and drops the
+		`invalidated` properties from it.
+		
+		The state properties depending on the changed ones are notified
+		even if they changed back before the notifications went out, as
+		the scene must know that something happened.
+		"""
+		
+		forced = set()
+		for name, value in values.items():
+			if self.dbus_properties.get(name) != value:
+				forced.update(STATE_PROPERTIES.get(name, ()))
+		for name in invalidated:
+			# Can't tell, assume it changed
+			forced.update(STATE_PROPERTIES.get(name, ()))
+		
+		self.dbus_properties.update(values)
+		for name in invalidated:
+			self.dbus_properties.pop(name, None)
+		
+		self.forced_properties.update(forced)
+		self.queue_notify(*forced)
+	
+	def on_dbus_properties_changed(self, proxy, changed, invalidated):
+		"""
+		Fired when channels sent PropertiesChanged.
+		"""
+		
+		self.update_dbus_properties(changed.unpack(), invalidated)
+		
+		# Unchanged values won't be notified, so we can be generous
+		self.queue_notify(*DBUS_PROPERTIES)
+		self.queue_notify(*DERIVED_PROPERTIES)
+	
+	def start_download_rate(self):
+		"""
+		Starts updating the download-rate and download-eta properties.
+		"""
+		
+		if self.download_rate_timeout > 0:
+			return
+		
+		self.download_rate_polled = 0
+		self.download_rate_timeout = GLib.timeout_add(
+			self.download_rate_interval,
+			self.update_download_rate
+		)
+	
+	def update_download_rate(self):
+		"""
+		Updates the download-rate and download-eta properties.
+		"""
+		
+		rate = None
+		if self.download_estimator.total > 0 and self.dbus_properties.get("Downloading"):
+			rate = self.download_estimator.update()
+		
+		if rate is not None:
+			eta = self.download_estimator.eta
 			
-			# Update download size
-			self.notify("update-required-download")
-		elif signal == "PackageInstallProgressChanged":
-			# Package install progress changed
-			print(params[0], round(params[0]) / 100.0)
-			self.set_property("install-progress", params[0] / 100.0)
-		elif signal == "PackageInstallStarted":
-			# Package install progress started
-			self.notify("installing")
+			self.set_property("download-rate", _("%s/s") % format_size(rate))
+			self.set_property("download-eta", format_duration(eta) if eta is not None else "")
+		else:
+			# Fallback
+			self.download_rate_polled += self.download_rate_interval
 			
-			self.set_property("install-progress", 0.0)
-			self.set_property("install-scene-label", _("Semplice is installing the updates"))
-		elif signal == "PackageInstallFinished":
-			# Package install progress finished
-			self.notify("installing")
+			if self.download_rate_polled >= self.download_rate_poll_interval * 1000:
+				self.download_rate_polled = 0
+				self.set_property("download-rate", self.Properties.Get("(ss)", IFACE, "CurrentDownloadRate"))
+				self.set_property("download-eta", self.Properties.Get("(ss)", IFACE, "CurrentDownloadETA"))
+		
+		return True
+	
+	def queue_notify(self, *names):
+		"""
+		Queues a notification for the properties in `names`.
+		
+		Notifications are coalesced: every property queued during the
+		current main loop iteration is notified only once, right after it,
+		and only if its value changed since the last notification (or if
+		it's in forced_properties).
+		"""
+		
+		self.dirty_properties.update(names)
+		
+		if self.notify_source == 0:
+			self.notify_source = GLib.idle_add(
+				self.flush_notify,
+				priority=GLib.PRIORITY_HIGH_IDLE
+			)
+	
+	def flush_notify(self):
+		"""
+		Notifies the queued properties.
+		"""
+		
+		self.notify_source = 0
+		
+		names, self.dirty_properties = self.dirty_properties, set()
+		forced, self.forced_properties = self.forced_properties, set()
+		
+		self.freeze_notify()
+		for name in names:
+			value = self.get_property(name)
 			
-			self.set_property("install-progress", 1.0) # assume 100%
-			self.set_property("install-scene-label", _("System update completed"))
-		elif signal == "PackageInstallFailed":
-			# Package install progress failed
-			self.emit("package-install-failed")
-			self.notify("installing")
+			if not name in forced and name in self.published and self.published[name] == value:
+				# Nothing to see here
+				self.notifications_suppressed += 1
+				continue
 			
-			self.set_property("install-scene-label", "System update failed")
-		elif signal == "LockFailed":
-			# APT Lock failed
-			self.emit("lock-failed")
-		elif signal == "GenericFailure":
-			# Generic failure
-			self.emit("generic-failure", *params)
-		
-		# Remove the download rate refresh operation if it has stopped
-		if signal in ("CacheUpdateStopped", "PackageAcquireStopped") and self.download_rate_timeout > 0:
+			self.published[name] = value
+			self.notifications_emitted += 1
+			self.notify(name)
+		self.thaw_notify()
+		
+		return False
+	
+	def on_dbus_signal_changed(self, proxy, sender, signal, params):
+		"""
+		Handles DBus signals.
+		"""
+		
+		# Update the property mirror before anything reads it
+		if signal in STATE_SIGNALS:
+			self.update_dbus_properties(*STATE_SIGNALS[signal])
+		
+		if signal in self.signal_handlers:
+			self.signal_handlers[signal](*params)
+			return
+		
+		if not signal in SIGNALS:
+			return
+		
+		properties, relay, method = SIGNALS[signal]
+		
+		if method:
+			getattr(self, method)(*params)
+		
+		if relay:
+			self.emit(relay, *params)
+		
+		if properties:
+			self.queue_notify(*properties)
+	
+	def on_update_found(self, id, name, version, reason, status, size):
+		"""
+		Fired when an update has been found.
+		"""
+		
+		self.found_updates[id] = [name, status]
+		self.update_sizes[name] = max(parse_size(size), 0)
+		
+		self.update_batch.append((id, name, version, reason, status, size))
+		
+		if len(self.update_batch) >= self.update_batch_size:
+			self.flush_updates()
+		elif self.update_batch_timeout == 0:
+			self.update_batch_timeout = GLib.timeout_add(
+				self.update_batch_delay,
+				self.flush_updates
+			)
+	
+	def flush_updates(self):
+		"""
+		Emits updates-found with the updates found so far.
+		"""
+		
+		if self.update_batch_timeout > 0:
+			GLib.source_remove(self.update_batch_timeout)
+			self.update_batch_timeout = 0
+		
+		if self.update_batch:
+			batch, self.update_batch = self.update_batch, []
+			self.emit("updates-found", batch)
+		
+		return False
+	
+	def on_package_status_changed(self, id, reason):
+		"""
+		Fired when the status of a package changed.
+		"""
+		
+		if id in self.found_updates:
+			self.found_updates[id][1] = (reason != "keep")
+		
+		# channels might have changed it on its own (e.g. along with a
+		# dependency), what we sent last doesn't matter anymore
+		self.sent_status.pop(id, None)
+		
+		self.queue_download_size_refresh()
+	
+	def on_update_check_stopped(self):
+		"""
+		Fired when channels finished checking for updates.
+		"""
+		
+		self.flush_updates()
+		self.invalidate_update_infos()
+		
+		self.emit("update-check-stopped")
+	
+	def on_update_check_started(self):
+		"""
+		Fired when channels started checking for updates.
+		"""
+		
+		self.found_updates = {}
+		self.update_sizes = {}
+		self.sent_status = {}
+		
+		# Drop what's left of the previous check
+		if self.update_batch_timeout > 0:
+			GLib.source_remove(self.update_batch_timeout)
+			self.update_batch_timeout = 0
+		
+		self.update_batch = []
+	
+	def on_acquire_started(self):
+		"""
+		Fired when channels started downloading the packages.
+		"""
+		
+		total = self.download_size
+		if total < 0:
+			total = sum(
+				self.update_sizes.get(name, 0)
+				for name, selected in self.found_updates.values()
+				if selected
+			)
+		
+		self.transaction_sizes = {}
+		self.download_estimator.reset(total)
+	
+	def on_acquire_item_fetch(self, transaction_id, description, shortdesc):
+		"""
+		Fired when a package is being downloaded.
+		"""
+		
+		self.transaction_sizes[transaction_id] = self.update_sizes.get(shortdesc, 0)
+		
+		self.on_item_fetch(transaction_id, description, shortdesc)
+	
+	def on_acquire_item_done(self, transaction_id):
+		"""
+		Fired when a package has been downloaded.
+		"""
+		
+		self.download_estimator.add(self.transaction_sizes.pop(transaction_id, 0))
+		
+		self.queue_download_size_refresh()
+	
+	def on_acquire_item_failed(self, transaction_id):
+		"""
+		Fired when a package failed to download.
+		"""
+		
+		# It won't be downloaded, don't wait for it
+		self.download_estimator.total -= self.transaction_sizes.pop(transaction_id, 0)
+	
+	def on_item_fetch(self, *params):
+		"""
+		Fired when an item is being fetched.
+		"""
+		
+		self.set_property("download-current-item", params[1])
+	
+	def on_install_progress_changed(self, progress):
+		"""
+		Fired when the installation progress changed.
+		"""
+		
+		self.set_property("install-progress", progress / 100.0)
+	
+	def on_install_started(self):
+		"""
+		Fired when the installation started.
+		"""
+		
+		self.set_property("install-progress", 0.0)
+		self.set_property("install-scene-label", _("Semplice is installing the updates"))
+		
+		self.start_install_eta()
+	
+	def on_install_finished(self):
+		"""
+		Fired when the installation completed.
+		"""
+		
+		self.set_property("install-progress", 1.0) # assume 100%
+		self.set_property("install-scene-label", _("System update completed"))
+		
+		self.install_pending = {}
+	
+	def on_install_failed(self):
+		"""
+		Fired when the installation failed.
+		"""
+		
+		self.emit("package-install-failed")
+		
+		self.install_pending = {}
+		
+		self.set_property("install-scene-label", "System update failed")
+	
+	def on_lock_failed(self):
+		"""
+		Fired when channels couldn't lock the APT database.
+		"""
+		
+		self.emit("lock-failed")
+	
+	def stop_download_rate(self):
+		"""
+		Removes the download rate refresh operation.
+		"""
+		
+		if self.download_rate_timeout > 0:
 			GLib.source_remove(self.download_rate_timeout)
 			self.download_rate_timeout = 0
 	
@@ -422,13 +1409,15 @@ class UpdateHandler(GObject.Object):
 		"""
 		
 		if property.name in ("refreshing", "downloading"):
-			value = self.Properties.Get("(ss)", IFACE, property.name.capitalize())
+			value = self.get_dbus_property(DBUS_PROPERTIES[property.name])
 			
 			# Refresh the download rate if value == True
-			if value == True and self.download_rate_timeout == 0:
-				self.download_rate_timeout = GLib.timeout_add_seconds(2, self.update_download_rate)
+			if value == True:
+				self.start_download_rate()
 			
 			return value
+		elif property.name in DBUS_PROPERTIES:
+			return self.get_dbus_property(DBUS_PROPERTIES[property.name])
 		elif property.name == "download-operation-label":
 			if self.props.downloading:
 				return _("Stop download")
@@ -441,15 +1430,17 @@ class UpdateHandler(GObject.Object):
 			else:
 				return _("Download & Install")
 		elif property.name == "update-required-download":
-			return self.Updates.GetUpdateInfos()[0]
-		elif property.name == "cache-opening":
-			return self.Properties.Get("(ss)", IFACE, "CacheOpening")
-		elif property.name == "checking":
-			return self.Properties.Get("(ss)", IFACE, "Checking")
-		elif property.name == "installing":
-			return self.Properties.Get("(ss)", IFACE, "Installing")
-		elif property.name == "cache-failure":
-			return self.Properties.Get("(ss)", IFACE, "CacheFailure")
+			self.get_update_infos()
+			
+			if self.download_size > -1:
+				return format_size(self.download_size)
+			
+			# Not there yet, or in a format we don't understand
+			return self.update_infos[0] if self.update_infos else ""
+		elif property.name == "update-required-download-bytes":
+			self.get_update_infos()
+			
+			return self.download_size
 		elif property.name == "cache-operation":
 			# cache_operation == cache_opening || refreshing
 			return (self.props.refreshing or self.props.cache_opening or self.props.checking)
@@ -457,7 +1448,16 @@ class UpdateHandler(GObject.Object):
 			# download_operation == downloading || refreshing
 			return (self.props.downloading or self.props.refreshing)
 		elif property.name == "download-completed":
-			return (self.props.update_required_download == "0 B")
+			self.get_update_infos()
+			
+			return (self.download_size == 0)
+		elif property.name == "connected":
+			return (self.bus is not None)
+		elif property.name == "install-eta":
+			if not self.install_pending:
+				return -1
+			
+			return max(0, round(self.install_eta))
 		else:
 			#return GObject.Object.do_get_property(self, property)
 			return (
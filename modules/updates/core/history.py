@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Authors:
+#    Eugenio "g7" Paolantonio <me@medesimo.eu>
+#
+
+import os
+import re
+import bz2
+import gzip
+import lzma
+import zlib
+import codecs
+
+# Openers for the compressed logs. They all return a stream that
+# decompresses on the fly.
+OPENERS = {
+	".gz" : gzip.open,
+	".xz" : lzma.open,
+	".bz2" : bz2.open,
+}
+
+# Lines written by apt at the start and at the end of every run
+RUN_STARTED = b"Log started: "
+RUN_ENDED = b"Log ended: "
+
+OUTCOME_COMPLETED = "completed"
+OUTCOME_FAILED = "failed"
+OUTCOME_INTERRUPTED = "interrupted"
+
+def open_log(path):
+	"""
+	Opens a (possibly compressed) log in binary mode.
+	"""
+	
+	return OPENERS.get(os.path.splitext(path)[1], open)(path, "rb")
+
+def rotated_logs(path):
+	"""
+	Returns the rotated copies of the log at `path` (path.1, path.2.gz,
+	...), newest first.
+	"""
+	
+	directory, name = os.path.split(path)
+	matcher = re.compile(r"^%s\.(\d+)(?:%s)?$" % (
+		re.escape(name),
+		"|".join(re.escape(suffix) for suffix in OPENERS)
+	))
+	
+	try:
+		files = os.listdir(directory)
+	except OSError:
+		return []
+	
+	logs = []
+	for file_ in files:
+		match = matcher.match(file_)
+		if match:
+			logs.append((int(match.group(1)), os.path.join(directory, file_)))
+	
+	return [log for number, log in sorted(logs)]
+
+def iter_lines(path, start=0, end=None):
+	"""
+	Streams the lines of a (possibly compressed) log.
+	
+	This is a generator that yields (offset, line) tuples, where offset
+	is the offset of the line in the uncompressed log and line is a
+	bytes object. Reading begins at the uncompressed offset `start` and
+	stops before the one at `end`, so that nothing past it is
+	decompressed.
+	"""
+	
+	with open_log(path) as f:
+		if start:
+			# Compressed streams can't really seek, but at least the
+			# decompressed data doesn't get to Python
+			f.seek(start)
+		
+		offset = start
+		for line in f:
+			if end is not None and offset >= end:
+				break
+			
+			yield offset, line
+			offset += len(line)
+
+class Run:
+	
+	"""
+	An upgrade run found in a log.
+	
+	`start` and `end` are uncompressed offsets in the log at `path`,
+	`started` is the date written by apt when the run started (if any).
+	"""
+	
+	__slots__ = ("path", "start", "end", "started", "outcome")
+	
+	def __init__(self, path, start, end, started, outcome):
+		"""
+		Initializes the class.
+		"""
+		
+		self.path = path
+		self.start = start
+		self.end = end
+		self.started = started
+		self.outcome = outcome
+	
+	def read(self, size=256 * 1024):
+		"""
+		Streams the text of the run, in chunks of about `size` bytes.
+		"""
+		
+		decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+		
+		chunk = []
+		length = 0
+		for offset, line in iter_lines(self.path, self.start, self.end):
+			chunk.append(line)
+			length += len(line)
+			
+			if length >= size:
+				yield decoder.decode(b"".join(chunk))
+				chunk = []
+				length = 0
+		
+		yield decoder.decode(b"".join(chunk), True)
+
+class LogHistory:
+	
+	"""
+	The upgrade runs found in the system update log and in its rotated
+	copies.
+	
+	The runs of every file are indexed the first time they are
+	requested, while the file is being streamed, and are remembered for
+	as long as the file doesn't change (rotated files are recognised
+	even after they have been renamed).
+	"""
+	
+	def __init__(self, path):
+		"""
+		Initializes the class.
+		
+		`path` is the path of the current log.
+		"""
+		
+		self.path = path
+		
+		# (device, inode, size, mtime) -> [(start, end, started, outcome), ...]
+		self.index = {}
+	
+	def get_files(self):
+		"""
+		Returns the log files, newest first.
+		"""
+		
+		files = [self.path] if os.path.exists(self.path) else []
+		
+		return files + rotated_logs(self.path)
+	
+	def get_runs(self):
+		"""
+		A generator that yields the Run objects of every log file,
+		newest file first.
+		
+		Files that have not been indexed yet are only read as far as the
+		consumer goes.
+		"""
+		
+		for path in self.get_files():
+			try:
+				stat = os.stat(path)
+			except OSError:
+				# Rotated in the meantime
+				continue
+			
+			key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+			
+			if key in self.index:
+				for run in self.index[key]:
+					yield Run(path, *run)
+			else:
+				runs = []
+				for run in self._scan(path):
+					runs.append(run)
+					yield Run(path, *run)
+				
+				self.index[key] = runs
+	
+	def _scan(self, path):
+		"""
+		Streams the log at `path` and yields a (start, end, started,
+		outcome) tuple for every run found in it.
+		
+		Logs without the apt markers are considered as a single run.
+		"""
+		
+		start = end = 0
+		started = None
+		failed = False
+		ended = False
+		
+		try:
+			for offset, line in iter_lines(path):
+				end = offset + len(line)
+				
+				if line.startswith(RUN_STARTED):
+					if offset > start:
+						# Previous run (or what came before the first marker)
+						yield self._run(start, offset, started, failed, ended)
+					
+					start = offset
+					started = line[len(RUN_STARTED):].strip().decode("utf-8", errors="replace")
+					failed = ended = False
+				elif line.startswith(RUN_ENDED):
+					ended = True
+				elif line.startswith(b"E: ") or line.startswith(b"dpkg: error"):
+					failed = True
+		except (OSError, EOFError, lzma.LZMAError, zlib.error):
+			# Corrupted or truncated archive, keep what we have
+			failed = True
+		
+		if end > start:
+			yield self._run(start, end, started, failed, ended)
+	
+	def _run(self, start, end, started, failed, ended):
+		"""
+		Returns the index tuple of a run.
+		"""
+		
+		if failed:
+			outcome = OUTCOME_FAILED
+		elif ended or started is None:
+			# Logs without markers can't tell
+			outcome = OUTCOME_COMPLETED
+		else:
+			outcome = OUTCOME_INTERRUPTED
+		
+		return (start, end, started, outcome)
@@ -20,19 +20,24 @@
 #
 
 from veracc.widgets.UnlockBar import UnlockBar, ActionResponse
-from gi.repository import Gio, GObject, Gtk, Gdk, Pango
+from gi.repository import GLib, Gio, GObject, Gtk, Pango
 
-from .widgets import UpdateList, UpdateItem, CircularProgressBar
+from .widgets import UpdateList, UpdateItem, CircularProgressBar, HistoryDialog
 
 # FIXME pending AppStream API update. See #4
-#from .core.common import Database, Follower
-from .core.common import Follower
+#from .core.common import Database, new_follower
+from .core.common import AsyncFollower, new_follower, read_mapped, split_tail
+from .core.bus import get_proxy
 from .core.handler import UpdateHandler
+from .core.aptlog import LINE_RE, PHASE_UNPACK, PHASE_SETUP, AptLogParser
+from .core.history import LogHistory
 
 import os
 
 import time
 
+import collections
+
 import quickstart
 
 # As this is a separate VeraCC module, we need to load translations separately...
@@ -60,9 +65,11 @@ class Scene(quickstart.scenes.BaseScene):
 	events = {
 		"changed" : ["selected_channel"],
 		"toggled" : ["enable_proposed_updates", "enable_development_updates", "show_details_button"],
-		"clicked" : ["refresh_button", "download_button", "install_button"],
+		"clicked" : ["refresh_button", "history_button", "download_button", "install_button"],
 		"realize" : ["install_scene"],
 		"size-allocate" : ["details_textview"],
+		"populate-popup" : ["details_textview"],
+		"query-tooltip" : ["details_textview"],
 	}
 	
 	# Used to define the currently-enabled semplice-base channel. 
@@ -75,6 +82,26 @@ class Scene(quickstart.scenes.BaseScene):
 	
 	package_transactions = {}
 	
+	# channels' proxies, created the first time the scene gets called
+	# and reused afterwards
+	Channels = None
+	Providers = None
+	
+	# If True, the APT log is followed from a separate thread instead
+	# of from the main loop
+	threaded_log_reader = False
+	
+	# Maximum number of lines and characters kept in the details_buffer
+	# (0 means unlimited). Older lines are trimmed in batches of
+	# details_trim_lines, and can be loaded again on demand.
+	details_max_lines = 20000
+	details_max_chars = 4 * 1024 * 1024
+	details_trim_lines = 1000
+	
+	# Interval (in milliseconds) between two flushes of the log read,
+	# when the details_textview is not drawn
+	details_flush_interval = 250
+	
 	def on_scene_asked_to_close(self):
 		"""
 		Do some cleanup
@@ -121,6 +148,55 @@ class Scene(quickstart.scenes.BaseScene):
 		
 		# Determines if the log has been fully written to the buffer
 		self.log_written = False
+		
+		# Text read from the log that still has to be inserted in the
+		# details_buffer. The reader appends to it, and the details_textview
+		# frame clock drains it (or a timeout, when the details_textview
+		# is not drawn).
+		self.pending_text = collections.deque()
+		self.details_tick = 0
+		self.details_timeout = 0
+		
+		# read_mapped() generator used by dump_log(), if any
+		self.log_slices = None
+		
+		# Byte offsets in APT_LOGFILE of the batches trimmed from the
+		# details_buffer, oldest first, and of the first byte currently
+		# in the buffer (None if unknown, e.g. after a rotation).
+		# details_inode is the inode of the file they refer to.
+		self.details_trimmed = []
+		self.details_start = 0
+		self.details_inode = None
+		
+		# (inode, offset, tail) of the last chunk of APT_LOGFILE queued
+		# for the details_buffer. offset is the byte offset right after
+		# it, tail holds the last characters queued, used to detect
+		# truncations when resuming.
+		self.log_checkpoint = None
+		
+		# Lines loaded back through "Load earlier output", that don't
+		# count towards details_max_lines
+		self.details_extra_lines = 0
+		
+		# Parses the log as it is read, so that we know where every
+		# package has been installed. details_first_line is the parser
+		# line number of the first line in the details_buffer.
+		self.log_parser = AptLogParser()
+		self.details_first_line = 0
+		
+		# Number of packages that are being installed, used to estimate
+		# the progress from the log
+		self.install_total = 0
+		self.objects.details_textview.set_has_tooltip(True)
+		
+		# Number of unpacked and completed packages in log_parser
+		# already reported to the handler
+		self.log_unpacked = 0
+		self.log_completed = 0
+		
+		# Past runs, shared by every HistoryDialog so that the logs are
+		# indexed only once
+		self.history = LogHistory(APT_LOGFILE)
 
 		# Set appropriate font size and weight for the "Distribution upgrades" label
 		context = self.objects.distribution_upgrade_label.create_pango_context()
@@ -161,6 +237,27 @@ class Scene(quickstart.scenes.BaseScene):
 		#print(len(self.update_list), self.update_list.props.empty, self.update_list.props.selection_mode)
 		self.update_list.show_all()
 		
+		# Search entry and sort order, on top of the update list
+		search_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
+		
+		self.search_entry = Gtk.SearchEntry()
+		self.search_entry.set_placeholder_text(_("Search packages"))
+		self.search_entry.connect("search-changed", self.on_search_entry_search_changed)
+		search_box.pack_start(self.search_entry, True, True, 0)
+		
+		self.sort_combobox = Gtk.ComboBoxText()
+		self.sort_combobox.append("", _("Default order"))
+		self.sort_combobox.append("name", _("Sort by name"))
+		self.sort_combobox.append("size", _("Sort by size"))
+		self.sort_combobox.append("reason", _("Sort by operation"))
+		self.sort_combobox.set_active_id("")
+		self.sort_combobox.connect("changed", self.on_sort_combobox_changed)
+		search_box.pack_start(self.sort_combobox, False, False, 0)
+		
+		self.objects.application_updates_content.pack_start(search_box, False, False, 0)
+		self.objects.application_updates_content.reorder_child(search_box, 0)
+		search_box.show_all()
+		
 		# Open AppStream database
 		# FIXME pending AppStream API update. See #4
 		#Database.open()
@@ -180,8 +277,15 @@ class Scene(quickstart.scenes.BaseScene):
 		# Connect to generic failure:
 		self.handler.connect("generic-failure", self.on_generic_failure)
 		
-		# Connect to update found:
-		self.handler.connect("update-found", self.on_update_found)
+		# Connect to updates found:
+		self.handler.connect("updates-found", self.on_updates_found)
+		
+		# Connect to the end of the update checks
+		self.handler.connect("update-check-stopped", self.on_update_check_stopped)
+		self.handler.connect("update-check-failed", self.on_update_check_failed)
+		
+		# Connect to service-restarted
+		self.handler.connect("service-restarted", self.on_service_restarted)
 		
 		# Connect to package-status-changed
 		self.handler.connect("package-status-changed", self.on_package_status_changed)
@@ -203,6 +307,9 @@ class Scene(quickstart.scenes.BaseScene):
 		# React when installing
 		self.handler.connect("notify::installing", self.on_installing_changed)
 		
+		# React when the installation ETA changes
+		self.handler.connect("notify::install-eta", self.on_install_eta_changed)
+		
 		# React when we know the total size to download
 		self.handler.connect("notify::update-required-download", self.on_update_required_download_changed)
 		
@@ -355,6 +462,26 @@ class Scene(quickstart.scenes.BaseScene):
 			GObject.BindingFlags.SYNC_CREATE
 		)
 		
+		# The handler connects to channels without blocking, the
+		# please-wait view is shown in the meantime
+		if self.handler.props.connected:
+			self.on_handler_connected()
+		else:
+			self.objects.application_updates_checking_label.set_text(
+				_("Connecting to the update service")
+			)
+			self.handler.connect("notify::connected", self.on_handler_connected)
+	
+	def on_handler_connected(self, handler=None, value=None):
+		"""
+		Fired when the handler is connected to channels.
+		"""
+		
+		if not self.handler.props.connected:
+			return
+		
+		self.objects.application_updates_checking_label.set_text(_("Please wait"))
+		
 		# Switch into the installation mode if channels is already installing
 		if self.handler.props.installing:
 			self.on_installing_changed()
@@ -408,49 +535,495 @@ class Scene(quickstart.scenes.BaseScene):
 		Fired when the show_details_button has been toggled.
 		"""
 		
-		if button.props.active and not self.following_log and not self.log_written:
-			self.follow_log()
+		if button.props.active:
+			self.start_log_reader()
 	
-	@quickstart.threads.on_idle
-	def append_text(self, line):
+	def start_log_reader(self):
+		"""
+		Starts reading APT_LOGFILE into the details_buffer, unless it's
+		already being read or it has been read completely.
+		"""
+		
+		if self.following_log or self.log_written:
+			return
+		
+		# Set it here, so that the tick callback doesn't go away
+		# before the reader has started
+		self.following_log = True
+		
+		self.start_details_flush()
+		
+		offset = self.get_log_resume_offset()
+		if not self._installing:
+			self.dump_log(offset)
+		elif self.threaded_log_reader:
+			self.follow_log(offset)
+		else:
+			self.follow_log_async(offset)
+	
+	def get_log_resume_offset(self):
+		"""
+		Returns the offset in APT_LOGFILE from where the details_buffer
+		should be resumed.
+		
+		If the log has been rotated or truncated since the last time,
+		the details_buffer is cleared and 0 is returned.
+		"""
+		
+		if self.log_checkpoint is not None:
+			inode, offset, tail = self.log_checkpoint
+			
+			try:
+				with open(APT_LOGFILE, "rb") as f:
+					stat = os.fstat(f.fileno())
+					if stat.st_ino == inode and stat.st_size >= offset:
+						# Same file, but it might have been truncated and
+						# written again: check that the text we have is
+						# still there. Every character takes at most 4
+						# bytes, the extra ones let the decoder get in
+						# sync if they start in the middle of one.
+						start = max(offset - 4 * (len(tail) + 1), 0)
+						f.seek(start)
+						data = f.read(offset - start)
+						if data.decode("utf-8", errors="replace").endswith(tail):
+							return offset
+			except OSError:
+				pass
+		
+		self.clear_details()
+		
+		return 0
+	
+	def clear_details(self):
+		"""
+		Clears the details_buffer.
+		"""
+		
+		self.pending_text.clear()
+		self.objects.details_buffer.set_text("")
+		
+		self.details_trimmed = []
+		self.details_start = 0
+		self.details_inode = None
+		self.details_extra_lines = 0
+		
+		self.log_parser.reset()
+		self.details_first_line = 0
+		self.log_unpacked = 0
+		self.log_completed = 0
+		
+		self.log_checkpoint = None
+	
+	def append_text(self, text, inode, start, end):
+		"""
+		Queues the text for insertion in the details_buffer.
+		
+		`inode` is the inode of APT_LOGFILE, `start` and `end` the byte
+		offsets of what the text has been decoded from.
+		
+		This is safe to call from any thread: the text is parsed by the
+		main thread, once it gets inserted in the details_buffer.
+		"""
+		
+		self.pending_text.append((text, inode, start, end))
+		
+		# The text is compared with the file, decoded again, when
+		# resuming
+		tail = text[-16:]
+		if len(tail) < 16 and self.log_checkpoint is not None:
+			previous_inode, previous_end, previous_tail = self.log_checkpoint
+			if (previous_inode, previous_end) == (inode, start):
+				tail = (previous_tail + tail)[-16:]
+		
+		self.log_checkpoint = (inode, end, tail)
+	
+	def start_details_flush(self):
+		"""
+		Ensures that the queued text gets inserted in the details_buffer.
+		"""
+		
+		if self.details_tick == 0:
+			self.details_tick = self.objects.details_textview.add_tick_callback(
+				self.on_details_textview_tick
+			)
+		
+		# The tick callback only runs while the details_textview is
+		# realized and drawn, but the log has to be parsed for the
+		# progress and the ETA anyway
+		if self.details_timeout == 0:
+			self.details_timeout = GLib.timeout_add(
+				self.details_flush_interval,
+				self.on_details_flush_timeout
+			)
+	
+	def on_details_textview_tick(self, textview, frame_clock):
+		"""
+		Flushes the queued text once per frame.
+		"""
+		
+		if self.flush_details():
+			return True
+		
+		self.details_tick = 0
+		return False
+	
+	def on_details_flush_timeout(self):
+		"""
+		Flushes the queued text when the details_textview is not drawn.
+		"""
+		
+		if self.flush_details():
+			return True
+		
+		self.details_timeout = 0
+		return False
+	
+	def flush_details(self):
+		"""
+		Parses everything that has been queued since the previous call
+		and inserts it in the details_buffer, at once.
+		
+		Returns True while there is (or there might be) more to flush.
+		"""
+		
+		chunks = []
+		while self.pending_text:
+			text, inode, start, end = self.pending_text.popleft()
+			self.log_parser.feed(text, inode, start, end)
+			
+			if inode != self.details_inode:
+				if self.details_inode is not None:
+					# Rotated while following, the trimmed offsets
+					# refer to the old file, and the parser started
+					# counting lines again
+					self.details_trimmed = []
+					self.details_start = None
+					self.details_first_line = -(
+						self.objects.details_buffer.get_line_count() - 1
+						+ sum(chunk.count("\n") for chunk in chunks)
+					)
+				self.details_inode = inode
+			
+			chunks.append(text)
+		
+		if chunks:
+			self.objects.details_buffer.insert(
+				self.objects.details_buffer.get_end_iter(),
+				"".join(chunks)
+			)
+			
+			self.trim_details()
+			
+			# Keep the progress going even if channels doesn't report it
+			# often enough
+			if self._installing:
+				progress = self.log_parser.get_progress(self.install_total)
+				if progress is not None and progress > self.handler.props.install_progress:
+					self.handler.set_property("install-progress", progress)
+				
+				# Update the ETA
+				unpacked = self.log_parser.unpacked_names
+				completed = self.log_parser.completed_names
+				if self.log_unpacked > len(unpacked) or self.log_completed > len(completed):
+					# The parser has been reset
+					self.log_unpacked = 0
+					self.log_completed = 0
+				for name in unpacked[self.log_unpacked:]:
+					self.handler.package_unpacked(name)
+				for name in completed[self.log_completed:]:
+					self.handler.package_completed(name)
+				self.log_unpacked = len(unpacked)
+				self.log_completed = len(completed)
+		
+		# following_log must be checked before pending_text, as the
+		# reader queues its last chunk before resetting it
+		return self.following_log or len(self.pending_text) > 0
+	
+	def trim_details(self):
+		"""
+		Removes the oldest lines from the details_buffer if it grew
+		past details_max_lines or details_max_chars.
+		"""
+		
+		buffer = self.objects.details_buffer
+		line_count = buffer.get_line_count()
+		
+		# Number of lines to remove
+		trim = 0
+		
+		max_lines = self.details_max_lines + self.details_extra_lines
+		if self.details_max_lines and line_count > max_lines + self.details_trim_lines:
+			trim = line_count - max_lines
+		
+		char_count = buffer.get_char_count()
+		if self.details_max_chars and char_count > self.details_max_chars:
+			trim = max(
+				trim,
+				buffer.get_iter_at_offset(char_count - self.details_max_chars).get_line() + 1,
+				# Don't trim too often
+				min(self.details_trim_lines, line_count - 1)
+			)
+		
+		if trim == 0:
+			return
+		
+		# Remove in batches, recording where every batch starts in the
+		# file
+		start = buffer.get_start_iter()
+		for line in range(0, trim, self.details_trim_lines):
+			end = buffer.get_iter_at_line(min(line + self.details_trim_lines, trim))
+			
+			if self.details_start is not None:
+				self.details_trimmed.append(self.details_start)
+				self.details_start += len(buffer.get_text(start, end, True).encode("utf-8"))
+			
+			start = end
+		
+		buffer.delete(buffer.get_start_iter(), start)
+		
+		self.details_first_line += trim
+		self.details_extra_lines = max(0, self.details_extra_lines - trim)
+	
+	def load_earlier_details(self):
 		"""
-		Appends the text to the details_buffer.
+		Reads back the latest batch trimmed from the details_buffer.
 		"""
 		
-		self.objects.details_buffer.insert(
-			self.objects.details_buffer.get_end_iter(),
-			line
+		if not self.details_trimmed:
+			return
+		
+		try:
+			with open(APT_LOGFILE, "rb") as f:
+				if os.fstat(f.fileno()).st_ino != self.details_inode:
+					# Rotated, the offsets are not valid anymore
+					self.details_trimmed = []
+					return
+				
+				offset = self.details_trimmed[-1]
+				f.seek(offset)
+				text = f.read(self.details_start - offset).decode("utf-8", errors="replace")
+		except OSError:
+			return
+		
+		self.details_trimmed.pop()
+		self.details_start = offset
+		
+		buffer = self.objects.details_buffer
+		line_count = buffer.get_line_count()
+		buffer.insert(buffer.get_start_iter(), text)
+		
+		loaded = buffer.get_line_count() - line_count
+		self.details_first_line -= loaded
+		self.details_extra_lines += loaded
+	
+	def scroll_details_to_package(self, name):
+		"""
+		Scrolls the details_textview to where the package `name` has
+		been first mentioned in the log.
+		
+		Returns False if the package is not known, or if that part of
+		the log is not in the details_buffer.
+		"""
+		
+		entry = self.log_parser.packages.get(name)
+		if entry is None:
+			return False
+		
+		line = min(line for timestamp, offset, line in entry.phases.values()) - self.details_first_line
+		if line < 0:
+			return False
+		
+		self.objects.details_textview.scroll_to_iter(
+			self.objects.details_buffer.get_iter_at_line(line),
+			0.0,
+			True,
+			0.0,
+			0.0
 		)
+		
+		return True
 	
-	@quickstart.threads.thread
-	def follow_log(self):
+	def on_details_textview_query_tooltip(self, textview, x, y, keyboard_mode, tooltip):
 		"""
-		Follows the APT logfile
+		Shows how long it took to install the package under the pointer.
 		"""
 		
-		self.following_log = True
+		x, y = textview.window_to_buffer_coords(Gtk.TextWindowType.WIDGET, x, y)
+		
+		itr = textview.get_iter_at_location(x, y)
+		if isinstance(itr, tuple):
+			# GTK+ >= 3.20
+			found, itr = itr
+			if not found:
+				return False
+		
+		start = itr.copy()
+		start.set_line_offset(0)
+		end = start.copy()
+		end.forward_to_line_end()
+		
+		match = LINE_RE.match(self.objects.details_buffer.get_text(start, end, True))
+		if not match or match.lastgroup == "failure":
+			return False
+		
+		entry = self.log_parser.packages.get(match.group(match.lastgroup).split(":", 1)[0])
+		if entry is None:
+			return False
+		
+		if entry.duration is not None:
+			tooltip.set_text(_("%(package)s: completed in %(seconds).1f seconds") % {
+				"package" : entry.name,
+				"seconds" : entry.duration
+			})
+		else:
+			tooltip.set_text(_("%s: in progress") % entry.name)
+		
+		return True
+	
+	def on_details_textview_populate_popup(self, textview, popup):
+		"""
+		Adds the "Load earlier output", "Go to the failed package" and
+		"Update history" items to the details_textview context menu.
+		"""
+		
+		if not isinstance(popup, Gtk.Menu):
+			return
+		
+		item = Gtk.MenuItem.new_with_label(_("Load earlier output"))
+		item.set_sensitive(len(self.details_trimmed) > 0)
+		item.connect("activate", lambda item: self.load_earlier_details())
+		
+		popup.append(Gtk.SeparatorMenuItem())
+		popup.append(item)
+		
+		# dpkg errors carry the package name, apt ones don't
+		failed = [
+			name
+			for timestamp, offset, line, name in self.log_parser.errors
+			if name in self.log_parser.packages
+		]
+		
+		item = Gtk.MenuItem.new_with_label(_("Go to the failed package"))
+		item.set_sensitive(len(failed) > 0)
+		item.connect("activate", lambda item: self.scroll_details_to_package(failed[0]))
+		
+		popup.append(item)
+		
+		item = Gtk.MenuItem.new_with_label(_("Update history"))
+		item.connect(
+			"activate",
+			lambda item: HistoryDialog(self.objects.main.get_toplevel(), self.history)
+		)
+		
+		popup.append(item)
+		popup.show_all()
+	
+	@quickstart.threads.thread
+	def follow_log(self, offset=0):
+		"""
+		Follows the APT logfile, starting from `offset`.
+		"""
 		
 		# Wait until it has been properly created
 		while not os.path.exists(APT_LOGFILE) and self._installing:
 			time.sleep(1)
 		
 		if self._installing:
-			self.follower = Follower(APT_LOGFILE)
-			for line in self.follower:
-				Gdk.threads_enter()
-				self.append_text(line)
-				Gdk.threads_leave()
+			# self.follower is reset from the main thread when the
+			# installation finishes, so keep our own reference
+			follower = self.follower = new_follower(APT_LOGFILE, offset)
+			for chunk in follower:
+				self.append_text(chunk, follower.inode, follower.chunk_start, follower.chunk_end)
+			
+			self.following_log = False
 		else:
 			# Not installed anymore, the upgrade process completed
-			# So directly dump the entire file:
-			with open(APT_LOGFILE) as f:
-				for line in f:
-					Gdk.threads_enter()
-					self.append_text(line)
-					Gdk.threads_leave()
+			# So directly dump the rest of the file
+			GLib.idle_add(self.dump_log, offset)
+	
+	def dump_log(self, offset=0):
+		"""
+		Dumps the completed APT logfile, starting from `offset`.
+		
+		The file is memory-mapped and queued in large slices, one per
+		main loop iteration.
+		"""
+		
+		self.following_log = True
+		self.start_details_flush()
+		
+		if offset == 0 and (self.details_max_lines or self.details_max_chars):
+			# Only the last lines would be kept anyway, so skip the
+			# others and just index them for "Load earlier output"
+			try:
+				offset, self.details_trimmed = split_tail(
+					APT_LOGFILE,
+					self.details_max_lines,
+					self.details_max_chars,
+				)
+				self.details_start = offset
+				self.details_inode = os.stat(APT_LOGFILE).st_ino
+			except OSError:
+				pass
+		
+		self.log_slices = read_mapped(APT_LOGFILE, offset)
+		GLib.idle_add(self.on_dump_log_idle, self.log_slices)
+		
+		return False
+	
+	def on_dump_log_idle(self, slices):
+		"""
+		Queues the next slice of the APT logfile.
+		"""
+		
+		if slices is not self.log_slices:
+			# Cancelled by a new installation
+			return False
+		
+		try:
+			text, inode, start, end = next(slices)
+		except StopIteration:
+			self.log_slices = None
 			self.log_written = True
+			self.following_log = False
+			return False
+		except (OSError, ValueError):
+			# Unreadable
+			self.log_slices = None
+			self.following_log = False
+			return False
 		
-		self.following_log = False
+		self.append_text(text, inode, start, end)
+		
+		return True
+	
+	def follow_log_async(self, offset=0):
+		"""
+		Follows the APT logfile from the main loop, starting from `offset`.
+		"""
+		
+		self.follower = AsyncFollower(
+			APT_LOGFILE,
+			self.append_text,
+			follow=self._installing,
+			done_callback=self.on_follower_done,
+			offset=offset
+		)
+		self.follower.start()
+	
+	def on_follower_done(self, follower):
+		"""
+		Fired when the AsyncFollower stopped.
+		"""
+		
+		if not follower.follow:
+			# The whole file has been dumped
+			self.log_written = True
+		
+		# on_installing_changed() might have already dropped it
+		if self.follower in (follower, None):
+			self.follower = None
+			self.following_log = False
 	
 	def on_details_textview_size_allocate(self, textview, allocation):
 		"""
@@ -468,8 +1041,43 @@ class Scene(quickstart.scenes.BaseScene):
 		
 		# FIXME: Remove that once proper DBus proprieties caching
 		# has been implemented
+		was_installing = self._installing
+		
+		if self.handler.props.installing != was_installing:
+			# Parse what has been queued so far, it belongs to the
+			# previous state
+			self.flush_details()
+		
 		self._installing = self.handler.props.installing
 		
+		if self._installing and not was_installing:
+			if self.log_slices is not None:
+				# Still dumping the previous log, the new run has to
+				# be followed instead
+				self.log_slices = None
+				self.following_log = False
+			
+			# New run: forget the packages of the previous one. The log
+			# is parsed again from where the details_buffer stops.
+			self.log_parser.reset()
+			self.log_unpacked = 0
+			self.log_completed = 0
+			self.details_first_line = -(self.objects.details_buffer.get_line_count() - 1)
+		
+		if was_installing and not self._installing:
+			# Remember how long every package took, for the next ETAs.
+			# The last phase line lasted until now. Packages parsed in a
+			# single chunk (e.g. when the scene connected in the middle
+			# of a run) have no meaningful duration.
+			self.flush_details()
+			self.log_parser.charge()
+			self.handler.durations.record(
+				(entry.name, entry.unpack_time, entry.configure_time)
+				for entry in self.log_parser.packages.values()
+				if PHASE_UNPACK in entry.phases and PHASE_SETUP in entry.phases
+				and entry.unpack_time + entry.configure_time > 0
+			)
+		
 		# FIXME: Should move that elsewhere
 		if not self._installing and self.following_log and self.follower:
 			# Stop the follower
@@ -481,6 +1089,11 @@ class Scene(quickstart.scenes.BaseScene):
 		if self._installing:
 			# New installation, ensure that we are in a somewhat clean state
 			self.log_written = False
+			self.install_total = self.update_list.get_selected_count()
+			
+			# Follow the log for the whole installation, even if the
+			# details are hidden: the progress and the ETA depend on it
+			self.start_log_reader()
 			
 			# Hide the details scrolled for now
 			self.objects.details_scrolled.hide()
@@ -488,6 +1101,22 @@ class Scene(quickstart.scenes.BaseScene):
 			# Finally, show the scene!
 			self.scene_container.set_visible_child(self.objects.install_scene)
 
+	def on_install_eta_changed(self, handler, value):
+		"""
+		Fired when handler's install-eta property changed.
+		"""
+		
+		eta = self.handler.props.install_eta
+		
+		if eta < 0:
+			text = None
+		elif eta < 60:
+			text = _("Less than a minute left")
+		else:
+			text = _("About %d minutes left") % round(eta / 60.0)
+		
+		self.objects.progress_stack.set_tooltip_text(text)
+	
 	def on_generic_failure(self, handler, error, description):
 		"""
 		Fired when the APT Lock failed.
@@ -517,13 +1146,62 @@ class Scene(quickstart.scenes.BaseScene):
 			_("Please close the active package managers.")
 		)
 	
-	@quickstart.threads.on_idle
-	def on_update_found(self, handler, id, name, version, reason, status, size):
+	def on_updates_found(self, handler, updates):
+		"""
+		Fired when a batch of updates has been found.
+		
+		This is not deferred to an idle callback, so that the last batch
+		(flushed by UpdateCheckStopped) is in the list before the list
+		gets expanded in on_checking_changed().
+		"""
+		
+		self.update_list.add_items(updates)
+	
+	def on_search_entry_search_changed(self, entry):
+		"""
+		Fired when the search text has been changed.
+		"""
+		
+		self.update_list.set_search(entry.get_text())
+	
+	def on_sort_combobox_changed(self, combobox):
+		"""
+		Fired when the sort order has been changed.
+		"""
+		
+		key = combobox.get_active_id()
+		
+		# Biggest packages first
+		self.update_list.set_sort(key or None, descending=(key == "size"))
+	
+	def on_update_check_stopped(self, handler):
 		"""
-		Fired when an update has been found.
+		Fired when an update check has been completed.
 		"""
 		
-		self.update_list.add_item(id, name, version, reason, status, size)
+		# Remove what's not there anymore, if we were synchronizing
+		self.update_list.end_sync()
+	
+	def on_update_check_failed(self, handler):
+		"""
+		Fired when an update check failed.
+		"""
+		
+		# Keep the list as it is
+		self.update_list.end_sync(remove=False)
+	
+	def on_service_restarted(self, handler):
+		"""
+		Fired when channels has been restarted.
+		"""
+		
+		if self.handler.props.installing or self.handler.props.refreshing or self.handler.props.checking:
+			# It will tell us
+			return
+		
+		# Check again, updating the list rather than rebuilding it
+		self.update_list.begin_sync()
+		self.handler.check()
 	
 	@quickstart.threads.on_idle
 	def on_package_status_changed(self, handler, id, reason):
@@ -539,12 +1217,11 @@ class Scene(quickstart.scenes.BaseScene):
 		Fired when a package is being fetched.
 		"""
 		
-		if not shortdesc in self.update_list.names_with_id:
+		# Get package id from the UpdateList
+		id = self.update_list.index.get_id(shortdesc)
+		if id is None:
 			# wat?
 			return
-
-		# Get package id from the UpdateList			
-		id = self.update_list.names_with_id[shortdesc]
 		
 		# Associate transaction with the id
 		self.package_transactions[transaction_id] = id
@@ -625,6 +1302,13 @@ class Scene(quickstart.scenes.BaseScene):
 		
 		self.handler.refresh()
 	
+	def on_history_button_clicked(self, button):
+		"""
+		Fired when the history button has been clicked.
+		"""
+		
+		HistoryDialog(self.objects.main.get_toplevel(), self.history)
+	
 	def on_checking_changed(self, handler, value):
 		"""
 		Fired when handler's checking property changed.
@@ -771,27 +1455,39 @@ class Scene(quickstart.scenes.BaseScene):
 
 		# Enter in the bus
 		self.bus_cancellable = Gio.Cancellable()
-		self.bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, self.bus_cancellable)
-		self.Channels = Gio.DBusProxy.new_sync(
-			self.bus,
-			0,
-			None,
-			BUS_NAME,
-			"/org/semplicelinux/channels/channels",
-			"org.semplicelinux.channels.channels",
-			self.bus_cancellable
-		)
-		self.Providers = Gio.DBusProxy.new_sync(
-			self.bus,
-			0,
-			None,
-			BUS_NAME,
-			"/org/semplicelinux/channels/providers",
-			"org.semplicelinux.channels.providers",
-			self.bus_cancellable
-		)
 
 		# We are locked
 		self.unlockbar.emit("locked")
 		
-		self.load()
+		if self.Channels is not None and self.Providers is not None:
+			self.load()
+		else:
+			# The channel settings stay empty until the proxies are ready
+			get_proxy(
+				"/org/semplicelinux/channels/channels",
+				"org.semplicelinux.channels.channels",
+				self.on_proxy_ready,
+				name=BUS_NAME
+			)
+			get_proxy(
+				"/org/semplicelinux/channels/providers",
+				"org.semplicelinux.channels.providers",
+				self.on_proxy_ready,
+				name=BUS_NAME
+			)
+	
+	def on_proxy_ready(self, proxy):
+		"""
+		Fired when the Channels or the Providers proxy is ready.
+		"""
+		
+		if proxy is None or self.bus_cancellable.is_cancelled():
+			return
+		
+		if proxy.get_interface_name() == "org.semplicelinux.channels.channels":
+			self.Channels = proxy
+		else:
+			self.Providers = proxy
+		
+		if self.Channels is not None and self.Providers is not None:
+			self.load()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Authors:
+#    Eugenio "g7" Paolantonio <me@medesimo.eu>
+#
+
+import os
+import lzma
+import zlib
+
+from gi.repository import Gtk, GLib
+
+from ..core.history import OUTCOME_COMPLETED, OUTCOME_FAILED
+
+class HistoryDialog(Gtk.Dialog):
+	
+	"""
+	A dialog that shows the past upgrade runs, read from the system
+	update log and its rotated copies.
+	
+	Runs are listed as the logs are indexed, and the text of a run is
+	only read when it gets selected.
+	"""
+	
+	def __init__(self, parent, history):
+		"""
+		Initializes the class.
+		
+		`history` is the LogHistory of the system update log.
+		"""
+		
+		super().__init__(
+			title=_("Update history"),
+			transient_for=parent,
+			modal=True,
+			destroy_with_parent=True
+		)
+		
+		self.add_button(_("Close"), Gtk.ResponseType.CLOSE)
+		self.set_default_size(750, 450)
+		
+		self.history = history
+		self.runs = []
+		
+		self.index_source = 0
+		self.read_source = 0
+		
+		paned = Gtk.Paned(orientation=Gtk.Orientation.HORIZONTAL)
+		paned.set_position(250)
+		self.get_content_area().pack_start(paned, True, True, 0)
+		
+		# Run list
+		self.model = Gtk.ListStore(
+			int, # Run number
+			str, # Date
+			str, # Outcome
+		)
+		
+		self.run_list = Gtk.TreeView(model=self.model)
+		self.run_list.append_column(
+			Gtk.TreeViewColumn(_("Started"), Gtk.CellRendererText(), text=1)
+		)
+		self.run_list.append_column(
+			Gtk.TreeViewColumn(_("Outcome"), Gtk.CellRendererText(), text=2)
+		)
+		self.run_list.get_selection().connect("changed", self.on_selection_changed)
+		
+		scrolled = Gtk.ScrolledWindow()
+		scrolled.set_shadow_type(Gtk.ShadowType.IN)
+		scrolled.add(self.run_list)
+		paned.pack1(scrolled, False, False)
+		
+		# Run log
+		self.buffer = Gtk.TextBuffer()
+		textview = Gtk.TextView(buffer=self.buffer)
+		textview.set_editable(False)
+		textview.set_wrap_mode(Gtk.WrapMode.WORD)
+		
+		scrolled = Gtk.ScrolledWindow()
+		scrolled.set_shadow_type(Gtk.ShadowType.IN)
+		scrolled.add(textview)
+		paned.pack2(scrolled, True, False)
+		
+		self.connect("response", lambda dialog, response: self.destroy())
+		self.connect("destroy", self.on_destroy)
+		
+		self.show_all()
+		
+		# Index the logs in the background
+		self.index_source = GLib.idle_add(self.on_index_idle, self.history.get_runs())
+	
+	def on_index_idle(self, runs):
+		"""
+		Adds the next run to the list.
+		"""
+		
+		try:
+			run = next(runs)
+		except StopIteration:
+			self.index_source = 0
+			return False
+		
+		if run.outcome == OUTCOME_COMPLETED:
+			outcome = _("Completed")
+		elif run.outcome == OUTCOME_FAILED:
+			outcome = _("Failed")
+		else:
+			outcome = _("Interrupted")
+		
+		self.model.append(
+			(
+				len(self.runs),
+				run.started or os.path.basename(run.path),
+				outcome
+			)
+		)
+		self.runs.append(run)
+		
+		return True
+	
+	def on_selection_changed(self, selection):
+		"""
+		Fired when a run has been selected.
+		"""
+		
+		model, itr = selection.get_selected()
+		
+		if self.read_source > 0:
+			GLib.source_remove(self.read_source)
+			self.read_source = 0
+		
+		self.buffer.set_text("")
+		
+		if itr is None:
+			return
+		
+		run = self.runs[model.get_value(itr, 0)]
+		self.read_source = GLib.idle_add(self.on_read_idle, run.read())
+	
+	def on_read_idle(self, chunks):
+		"""
+		Appends the next chunk of the selected run.
+		"""
+		
+		try:
+			chunk = next(chunks)
+		except (StopIteration, OSError, EOFError, lzma.LZMAError, zlib.error):
+			self.read_source = 0
+			return False
+		
+		self.buffer.insert(self.buffer.get_end_iter(), chunk)
+		
+		return True
+	
+	def on_destroy(self, dialog):
+		"""
+		Stops the pending operations.
+		"""
+		
+		for source in (self.index_source, self.read_source):
+			if source > 0:
+				GLib.source_remove(source)
+		
+		self.index_source = self.read_source = 0
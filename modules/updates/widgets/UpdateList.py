@@ -20,8 +20,13 @@
 #
 
 import os
+import bisect
 
-from gi.repository import Gtk, GLib, GObject
+from contextlib import contextmanager
+
+from gi.repository import Gtk, GObject
+
+from ..core.common import parse_size, format_size
 
 # FIXME pending AppStream API update. See #4
 #from ..core.common import Database
@@ -33,6 +38,112 @@ PACKAGE_ICON_NAME = "package-x-generic"
 
 icon_theme = Gtk.IconTheme.get_default()
 
+# Columns the list can be sorted by, see UpdateList.set_sort()
+SORT_COLUMNS = {
+	"name" : 4,
+	"size" : 6,
+	"reason" : 0,
+}
+
+class RowIndex:
+	
+	"""
+	Indexes the package rows of an UpdateList: it maps ids to iters and
+	package names to ids, and keeps track of the packages being
+	downloaded.
+	
+	Iters of a Gtk.TreeStore persist until their row is removed, and
+	aren't affected by sorting or filtering models stacked on top of
+	the store, so they are stored as they are. Gtk.TreeRowReferences
+	would have been updated by GTK+ on every row inserted or removed,
+	making every change O(n).
+	"""
+	
+	def __init__(self):
+		"""
+		Initializes the class.
+		"""
+		
+		self.clear()
+	
+	def clear(self):
+		"""
+		Forgets about every row.
+		"""
+		
+		self.iters = {}
+		self.ids = {}
+		self.names = {}
+		self.downloading = set()
+		
+		# Package names, sorted, for find_prefix()
+		self.sorted_names = []
+	
+	def add(self, id, name, itr):
+		"""
+		Adds the row `itr` of the package `name`.
+		"""
+		
+		self.iters[id] = itr
+		self.names[id] = name
+		
+		if not name in self.ids:
+			bisect.insort(self.sorted_names, name)
+		self.ids[name] = id
+	
+	def remove(self, id):
+		"""
+		Removes the row of `id` from the index, and returns its iter
+		(or None).
+		"""
+		
+		itr = self.iters.pop(id, None)
+		
+		name = self.names.pop(id, None)
+		if self.ids.get(name) == id:
+			del self.ids[name]
+			del self.sorted_names[bisect.bisect_left(self.sorted_names, name)]
+		
+		self.downloading.discard(id)
+		
+		return itr
+	
+	def get_iter(self, id):
+		"""
+		Returns the iter of `id`, or None.
+		"""
+		
+		return self.iters.get(id)
+	
+	def get_id(self, name):
+		"""
+		Returns the id of the package `name`, or None.
+		"""
+		
+		return self.ids.get(name)
+	
+	def find_prefix(self, prefix):
+		"""
+		Returns the ids of the packages whose name starts with `prefix`.
+		
+		This is a binary search on the sorted names, so it only costs
+		O(log n) plus the number of matches.
+		"""
+		
+		start = bisect.bisect_left(self.sorted_names, prefix)
+		end = bisect.bisect_left(self.sorted_names, prefix + "\U0010ffff", start)
+		
+		return [self.ids[name] for name in self.sorted_names[start:end]]
+	
+	def __contains__(self, id):
+		return id in self.iters
+	
+	def __iter__(self):
+		return iter(self.iters)
+	
+	def __len__(self):
+		return len(self.iters)
+
 class UpdateList(Gtk.TreeView):
 	"""
 	The package update list.
@@ -58,12 +169,20 @@ class UpdateList(Gtk.TreeView):
 	
 	dirty = False
 	
-	iters_with_id = {}
-	names_with_id = {}
+	# Batches of at least bulk_threshold items are added with the model
+	# detached from the view, see begin_bulk()
+	bulk_threshold = 100
+	bulk_depth = 0
+	bulk_expanded = ()
 	
-	currently_downloading = []
-	download_timeout = 0
+	# While downloading, the spinners of the visible rows are advanced
+	# every download_pulse_interval milliseconds, as long as the list
+	# is mapped
+	downloading_mode = False
+	download_tick = 0
+	download_pulse_interval = 50
 	download_pulse_value = 0
+	download_pulse_time = 0
 	
 	def __init__(self):
 		"""
@@ -72,6 +191,8 @@ class UpdateList(Gtk.TreeView):
 		
 		super().__init__()
 		
+		self.index = RowIndex()
+		
 		# Settings
 		self.set_headers_visible(False)
 		
@@ -83,13 +204,33 @@ class UpdateList(Gtk.TreeView):
 			int, # ID
 			str, # Name
 			str, # Version
-			str, # Size/Download status
+			GObject.TYPE_INT64, # Size in bytes, -1 if unknown
 			bool, # Downloading
-			int, # Downloading pulse
 			bool, # Checkbox and package_name visibility
 			bool, # Icon visibility
+			bool, # Visible (search)
+			str, # Download status
 		)
-		self.set_model(self.model)
+		
+		# The view shows the rows matching the search, see set_search()
+		self.filter = self.model.filter_new()
+		self.filter.set_visible_column(10)
+		
+		# The model attached to the view. It's a stack of models on top
+		# of self.model: use get_store_path() and get_view_path() to
+		# convert paths between them.
+		self.view_model = self.filter
+		self.set_model(self.view_model)
+		
+		# Sorted view of the filter, used in place of it when the list
+		# is sorted (see set_sort()). The columns are compared by GTK+
+		# itself, without calling back into Python.
+		self.sort = Gtk.TreeModelSort(model=self.filter)
+		
+		# Current search, and ids of the packages matching it (None if
+		# there is no search)
+		self.search_text = ""
+		self.search_matches = None
 		
 		# Create columns
 		
@@ -100,22 +241,26 @@ class UpdateList(Gtk.TreeView):
 		self.package_checkbox = Gtk.CellRendererToggle()
 		self.package_checkbox.set_activatable(True)
 		self.package_column.pack_start(self.package_checkbox, False)
-		self.package_column.add_attribute(self.package_checkbox, "visible", 9)
-		self.package_column.add_attribute(self.package_checkbox, "active", 1)
+		self.package_column.set_cell_data_func(self.package_checkbox, self.on_package_checkbox_data)
 		
 		# Handle checkbox toggled signal
 		self.package_checkbox.connect("toggled", self.on_status_toggled)
+		
+		# Only animate the spinners when they can be seen
+		self.connect("map", self.start_download_tick)
+		self.connect("unmap", self.stop_download_tick)
 
 		self.package_icon = Gtk.CellRendererPixbuf()
 		self.package_column.pack_start(self.package_icon, False)
-		self.package_column.add_attribute(self.package_icon, "visible", 10)
+		self.package_column.add_attribute(self.package_icon, "visible", 9)
 		self.package_column.add_attribute(self.package_icon, "icon_name", 2)
 
 		self.version_spinner = Gtk.CellRendererSpinner()
 		self.package_column.pack_start(self.version_spinner, False)
 		self.package_column.add_attribute(self.version_spinner, "visible", 7)
 		self.package_column.add_attribute(self.version_spinner, "active", 7)
-		self.package_column.add_attribute(self.version_spinner, "pulse", 8)
+		# The pulse is the same for every row, see on_download_tick()
+		self.package_column.set_cell_data_func(self.version_spinner, self.on_version_spinner_data)
 		
 		self.package_name = Gtk.CellRendererText()
 		self.package_column.pack_start(self.package_name, True)
@@ -130,8 +275,7 @@ class UpdateList(Gtk.TreeView):
 
 		self.version_size = Gtk.CellRendererText()
 		self.size_column.pack_start(self.version_size, True)
-		self.size_column.add_attribute(self.version_size, "visible", 9)
-		self.size_column.add_attribute(self.version_size, "text", 6)
+		self.size_column.set_cell_data_func(self.version_size, self.on_version_size_data)
 		
 		self.append_column(self.size_column)
 		
@@ -156,11 +300,16 @@ class UpdateList(Gtk.TreeView):
 		"""
 		
 		self.model.clear()
-		self.iters_with_id = {}
-		self.names_with_id = {}
+		self.index.clear()
 		self.dirty = False
+		
+		# ids not seen yet since begin_sync(), None if not syncing
+		self.stale_ids = None
 		self.notify("empty")
 		
+		if self.search_matches is not None:
+			self.search_matches = set()
+		
 		self.application_updates = self.model.append(
 			None,
 			(
@@ -170,11 +319,12 @@ class UpdateList(Gtk.TreeView):
 				-1,
 				_("Application updates"),
 				None,
-				_("Downloaded"), # Workaround
+				-1,
 				False,
-				0,
 				False,
 				False,
+				True,
+				_("Downloaded"), # Workaround
 			)
 		)
 		
@@ -187,11 +337,12 @@ class UpdateList(Gtk.TreeView):
 				-1,
 				_("Packages to install"),
 				None,
-				None,
+				-1,
 				False,
-				0,
 				False,
-				False
+				False,
+				True,
+				None
 			)
 		)
 		
@@ -204,11 +355,12 @@ class UpdateList(Gtk.TreeView):
 				-1,
 				_("Packages to remove"),
 				None,
-				None,
+				-1,
+				False,
 				False,
-				0,
 				False,
-				False
+				True,
+				None
 			)
 		)
 		
@@ -221,17 +373,32 @@ class UpdateList(Gtk.TreeView):
 				-1,
 				_("System updates"),
 				None,
-				None,
+				-1,
 				False,
-				0,
 				False,
-				False
+				False,
+				True,
+				None
 			)
 		)
+		
+		# section path -> [selected, total, matching the search, total size]
+		self.section_counts = {
+			self.model.get_string_from_iter(section) : [0, 0, 0, 0]
+			for section in (
+				self.application_updates,
+				self.to_install,
+				self.to_remove,
+				self.system_updates
+			)
+		}
+		
+		self.update_sections_visibility()
 	
-	def add_item(self, id, package_name, version, reason, status, size):
+	def get_row(self, id, package_name, version, reason, status, size):
 		"""
-		Adds an item.
+		Returns a (section, row) tuple for the given update, where
+		section is the iter of the section the row should be added to.
 		"""
 
 		# FIXME pending AppStream API update. See #4
@@ -264,38 +431,393 @@ class UpdateList(Gtk.TreeView):
 		else:
 			target = self.system_updates
 		
-		self.iters_with_id[id] = self.model.append(
-			target,
-			(
-				reason, # Reason
-				status, # Status
-				icon, # Icon
-				id, # ID
-				name, # Name
-				version, # Version
-				size, # size
-				False, # Downloading
-				0, # Downloading pulse
-				True, # Checkbox and package_name visibility
-				True, # Icon visibility
-			)
+		return target, (
+			reason, # Reason
+			status, # Status
+			icon, # Icon
+			id, # ID
+			name, # Name
+			version, # Version
+			parse_size(size), # Size
+			False, # Downloading
+			True, # Checkbox and package_name visibility
+			True, # Icon visibility
+			self.search_matches is None or package_name.startswith(self.search_text), # Visible (search)
+			None, # Download status
 		)
-		self.names_with_id[package_name] = id
+	
+	def add_item(self, id, package_name, version, reason, status, size):
+		"""
+		Adds an item.
+		"""
+		
+		self.add_items(((id, package_name, version, reason, status, size),))
+	
+	def add_items(self, items):
+		"""
+		Adds every item in `items`, an iterable of (id, package_name,
+		version, reason, status, size) tuples, in a single pass.
+		
+		Items already in the list are updated in place.
+		The empty property is notified only once.
+		"""
+		
+		items = list(items)
+		
+		if len(items) >= self.bulk_threshold and self.bulk_depth == 0:
+			with self.bulk():
+				return self.add_items(items)
 		
-		if not self.dirty:
+		model = self.model
+		
+		for item in items:
+			if self.stale_ids is not None:
+				self.stale_ids.discard(item[0])
+			
+			target, row = self.get_row(*item)
+			
+			itr = self.index.get_iter(item[0])
+			if itr is not None:
+				
+				# channels may hand out the ids again after a restart,
+				# so the row must also be of the same package
+				if model.get_value(itr, 0) == row[0] and self.index.names.get(item[0]) == item[1]:
+					# Same package and section, update what may have
+					# changed
+					self.update_status(item[0], "keep" if not row[1] else row[0])
+					
+					counts = self.section_counts[
+						model.get_string_from_iter(model.iter_parent(itr))
+					]
+					counts[3] += max(row[6], 0) - max(model.get_value(itr, 6), 0)
+					
+					# The new version hasn't been downloaded yet
+					model.set(itr, (5, 6, 11), (row[5], row[6], row[11]))
+					continue
+				
+				self.remove_item(item[0])
+			
+			self.index.add(item[0], item[1], model.append(target, row))
+			
+			counts = self.section_counts[model.get_string_from_iter(target)]
+			counts[0] += row[1]
+			counts[1] += 1
+			counts[3] += max(row[6], 0)
+			
+			if row[10] and self.search_matches is not None:
+				counts[2] += 1
+				self.search_matches.add(item[0])
+		
+		self.update_sections_visibility()
+		
+		if not self.dirty and len(self.index) > 0:
 			self.dirty = True
 			self.notify("empty")
 	
+	def get_store_path(self, path):
+		"""
+		Converts a path of the view to a path of self.model.
+		"""
+		
+		model = self.view_model
+		while model is not self.model:
+			path = model.convert_path_to_child_path(path)
+			model = model.get_model()
+		
+		return path
+	
+	def get_view_path(self, path):
+		"""
+		Converts a path of self.model to a path of the view, or returns
+		None if the row is not in the view (e.g. it has been filtered).
+		"""
+		
+		models = []
+		model = self.view_model
+		while model is not self.model:
+			models.append(model)
+			model = model.get_model()
+		
+		for model in reversed(models):
+			path = model.convert_child_path_to_path(path)
+			if path is None:
+				break
+		
+		return path
+	
+	def set_search(self, text):
+		"""
+		Shows only the packages whose name starts with `text`, and the
+		sections containing them. An empty `text` shows everything.
+		
+		Only the rows whose visibility changed are touched, so that
+		refining a search costs as much as the rows it hides.
+		"""
+		
+		text = text.strip().lower()
+		if text == self.search_text:
+			return
+		
+		self.search_text = text
+		
+		previous = self.search_matches
+		matches = self.search_matches = set(self.index.find_prefix(text)) if text else None
+		
+		if previous is None:
+			changes = ((id, False) for id in self.index if not id in matches)
+		elif matches is None:
+			changes = ((id, True) for id in self.index if not id in previous)
+		else:
+			changes = [(id, False) for id in previous - matches]
+			changes += [(id, True) for id in matches - previous]
+		
+		with self.bulk():
+			for id, visible in changes:
+				itr = self.index.get_iter(id)
+				self.model.set_value(itr, 10, visible)
+			
+			for counts in self.section_counts.values():
+				counts[2] = 0
+			
+			if matches is not None:
+				for id in matches:
+					parent = self.model.iter_parent(self.index.get_iter(id))
+					self.section_counts[self.model.get_string_from_iter(parent)][2] += 1
+			
+			self.update_sections_visibility()
+		
+		if matches:
+			self.expand_all()
+	
+	def update_sections_visibility(self):
+		"""
+		Shows the sections with packages matching the current search
+		(or every section, if there is no search).
+		"""
+		
+		for row in self.model:
+			visible = (
+				self.search_matches is None or
+				self.section_counts[self.model.get_string_from_iter(row.iter)][2] > 0
+			)
+			
+			if row[10] != visible:
+				row[10] = visible
+	
+	def begin_bulk(self):
+		"""
+		Detaches the model from the view, so that the view doesn't
+		handle every single change made before end_bulk().
+		
+		Calls can be nested, only the outermost pair has an effect.
+		"""
+		
+		self.bulk_depth += 1
+		
+		if self.bulk_depth > 1:
+			return
+		
+		# Remember the expanded sections, as the view forgets about
+		# them
+		self.bulk_expanded = [
+			self.get_store_path(row.path)
+			for row in self.view_model
+			if self.row_expanded(row.path)
+		]
+		
+		self.set_model(None)
+	
+	def end_bulk(self):
+		"""
+		Attaches the model again, restoring the expanded sections.
+		"""
+		
+		if self.bulk_depth == 0:
+			return
+		
+		self.bulk_depth -= 1
+		
+		if self.bulk_depth > 0:
+			return
+		
+		self.set_model(self.view_model)
+		
+		for path in self.bulk_expanded:
+			path = self.get_view_path(path)
+			if path is not None:
+				self.expand_row(path, False)
+		
+		self.bulk_expanded = ()
+	
+	@contextmanager
+	def bulk(self):
+		"""
+		A context manager that wraps begin_bulk() and end_bulk().
+		"""
+		
+		self.begin_bulk()
+		try:
+			yield
+		finally:
+			self.end_bulk()
+	
+	def remove_item(self, id):
+		"""
+		Removes an item.
+		"""
+		
+		itr = self.index.remove(id)
+		if itr is None:
+			return
+		
+		parent = self.model.iter_parent(itr)
+		counts = self.section_counts[self.model.get_string_from_iter(parent)]
+		counts[0] -= self.model.get_value(itr, 1)
+		counts[1] -= 1
+		counts[3] -= max(self.model.get_value(itr, 6), 0)
+		
+		if self.search_matches is not None and id in self.search_matches:
+			self.search_matches.discard(id)
+			counts[2] -= 1
+		
+		self.model.remove(itr)
+		self.model.row_changed(self.model.get_path(parent), parent)
+		
+		self.update_sections_visibility()
+		
+		if len(self.index) == 0 and self.dirty:
+			self.dirty = False
+			self.notify("empty")
+	
+	def begin_sync(self):
+		"""
+		Starts a synchronization: the items that won't be added again
+		(see add_items()) before end_sync() will be removed.
+		
+		This allows to reload the list without clearing it.
+		"""
+		
+		self.stale_ids = set(self.index)
+	
+	def end_sync(self, remove=True):
+		"""
+		Ends a synchronization, removing the items that haven't been
+		added again unless `remove` is False.
+		"""
+		
+		if self.stale_ids is None:
+			return
+		
+		stale, self.stale_ids = self.stale_ids, None
+		
+		if remove and stale:
+			with self.bulk():
+				for id in stale:
+					self.remove_item(id)
+	
 	def update_status(self, id, reason):
 		"""
 		Updates the status of an item.
 		"""
 		
-		if not id in self.iters_with_id:
+		itr = self.index.get_iter(id)
+		if itr is None:
 			# What?!
 			return
 		
-		self.model.set_value(self.iters_with_id[id], 1, False if reason == "keep" else True)
+		status = (reason != "keep")
+		
+		if self.model.get_value(itr, 1) == status:
+			return
+		
+		self.model.set_value(itr, 1, status)
+		
+		# Update the section checkbox
+		parent = self.model.iter_parent(itr)
+		self.section_counts[self.model.get_string_from_iter(parent)][0] += (1 if status else -1)
+		self.model.row_changed(self.model.get_path(parent), parent)
+	
+	def get_selected_count(self):
+		"""
+		Returns the number of packages that are going to be changed.
+		"""
+		
+		return sum(counts[0] for counts in self.section_counts.values())
+	
+	def on_package_checkbox_data(self, column, cell, model, itr, data):
+		"""
+		Sets the state of the checkbox of a row.
+		
+		The checkbox of a section is active when every package in it is
+		selected, and inconsistent when only some of them are.
+		"""
+		
+		if model.get_value(itr, 3) > -1:
+			cell.set_property("visible", True)
+			cell.set_property("inconsistent", False)
+			cell.set_property("active", model.get_value(itr, 1))
+		else:
+			selected, total, visible, size = self.section_counts[
+				self.model.get_string_from_iter(
+					self.get_store_iter(model, itr)
+				)
+			]
+			
+			cell.set_property("visible", total > 0)
+			cell.set_property("inconsistent", 0 < selected < total)
+			cell.set_property("active", selected == total)
+	
+	def on_version_size_data(self, column, cell, model, itr, data):
+		"""
+		Shows the size of a package (or its download status), or the
+		total size of a section.
+		"""
+		
+		if model.get_value(itr, 3) > -1:
+			text = model.get_value(itr, 11)
+			
+			if not text:
+				size = model.get_value(itr, 6)
+				text = format_size(size) if size > -1 else ""
+		else:
+			selected, total, visible, size = self.section_counts[
+				self.model.get_string_from_iter(
+					self.get_store_iter(model, itr)
+				)
+			]
+			
+			text = format_size(size) if total > 0 else ""
+		
+		cell.set_property("visible", bool(text))
+		cell.set_property("text", text)
+	
+	def set_sort(self, key=None, descending=False):
+		"""
+		Sorts the list by `key` (one of SORT_COLUMNS), or restores the
+		order the packages have been added in if `key` is None.
+		"""
+		
+		with self.bulk():
+			if key is None:
+				self.view_model = self.filter
+			else:
+				self.sort.set_sort_column_id(
+					SORT_COLUMNS[key],
+					Gtk.SortType.DESCENDING if descending else Gtk.SortType.ASCENDING
+				)
+				self.view_model = self.sort
+	
+	def get_store_iter(self, model, itr):
+		"""
+		Converts an iter of `model` (the view model, or one of the
+		models in between) to an iter of self.model.
+		"""
+		
+		while model is not self.model:
+			itr = model.convert_iter_to_child_iter(itr)
+			model = model.get_model()
+		
+		return itr
 	
 	def enable_downloading_mode(self):
 		"""
@@ -304,74 +826,117 @@ class UpdateList(Gtk.TreeView):
 		
 		print("Entering downloading mode")
 		
-		if self.download_timeout == 0:
-			self.download_timeout = GLib.timeout_add(50, self.on_download_timeout)
+		self.downloading_mode = True
+		self.start_download_tick()
 	
 	def disable_downloading_mode(self):
 		"""
 		Disables the 'downloading' mode.
 		"""
 		
-		if self.download_timeout > 0:
-			GLib.source_remove(self.download_timeout)
-			self.download_timeout = 0
+		self.downloading_mode = False
+		self.stop_download_tick()
 		
-		# Restore downloading status on currently_downloading items
-		for itr in self.currently_downloading:
+		# Restore downloading status on the items being downloaded
+		for id in self.index.downloading:
+			itr = self.index.get_iter(id)
+			
 			# Spinner
-			self.model.set_value(itr, 10, True)
+			self.model.set_value(itr, 9, True)
 			
 			# Downloading
 			self.model.set_value(itr, 7, False)
 		
-		self.currently_downloading = []
+		self.index.downloading.clear()
 		self.download_pulse_value = 0
 	
-	def on_download_timeout(self):
+	def start_download_tick(self, widget=None):
 		"""
-		Increments the pulse property of every item in self.currently_downloading.
+		Starts animating the spinners, if the list is in downloading
+		mode and it is mapped.
 		"""
 		
+		if self.downloading_mode and self.download_tick == 0 and self.get_mapped():
+			self.download_tick = self.add_tick_callback(self.on_download_tick)
+	
+	def stop_download_tick(self, widget=None):
+		"""
+		Stops animating the spinners.
+		"""
+		
+		if self.download_tick > 0:
+			self.remove_tick_callback(self.download_tick)
+			self.download_tick = 0
+	
+	def on_download_tick(self, widget, frame_clock):
+		"""
+		Advances the pulse of the spinners, redrawing the visible rows
+		of the items being downloaded.
+		"""
+		
+		now = frame_clock.get_frame_time()
+		if now - self.download_pulse_time < self.download_pulse_interval * 1000:
+			return True
+		
+		self.download_pulse_time = now
 		self.download_pulse_value += 1
-				
-		for itr in self.currently_downloading:
-			self.model.set_value(itr, 8, self.download_pulse_value)
+		
+		visible = self.get_visible_range()
+		if not visible or not self.index.downloading:
+			return True
+		
+		start, end = visible
+		for id in self.index.downloading:
+			path = self.get_view_path(self.model.get_path(self.index.get_iter(id)))
+			
+			if path is not None and start.compare(path) <= 0 and path.compare(end) <= 0:
+				area = self.get_cell_area(path, self.package_column)
+				x, y = self.convert_bin_window_to_widget_coords(area.x, area.y)
+				self.queue_draw_area(x, y, area.width, area.height)
 		
 		return True
 	
+	def on_version_spinner_data(self, column, cell, model, itr, data):
+		"""
+		Sets the pulse of the spinner of a row.
+		"""
+		
+		cell.set_property("pulse", self.download_pulse_value)
+	
 	def set_downloading(self, id, status):
 		"""
 		Sets the download flag on the id.
 		"""
 		
-		if not id in self.iters_with_id:
+		itr = self.index.get_iter(id)
+		if itr is None:
 			# What?!
 			return
-		
-		itr = self.iters_with_id[id]
 
 		if status:
-			# Add to self.currently_downloading
-			self.currently_downloading.append(itr)
+			# Add to the items being downloaded
+			self.index.downloading.add(id)
 			
 			# Hide icon
-			self.model.set_value(itr, 10, False)
+			self.model.set_value(itr, 9, False)
 			
 			
 			
 			#self.package_column.queue_resize()
 			#self.version_column.queue_resize()
-			self.scroll_to_cell(self.model.get_path(itr), None, False, 0.0, 0.0)
+			path = self.get_view_path(self.model.get_path(itr))
+			if path is not None:
+				self.scroll_to_cell(path, None, False, 0.0, 0.0)
 		else:
-			self.currently_downloading.remove(itr)
+			self.index.downloading.discard(id)
 			
 			# Show icon
-			self.model.set_value(itr, 10, True)
+			self.model.set_value(itr, 9, True)
 			
 			#self.model.set_value(itr, 7, status)
 			
 			# Set downloaded status
-			self.model.set_value(itr, 6, _("Downloaded"))
+			self.model.set_value(itr, 11, _("Downloaded"))
 			
 			#self.version_column.queue_resize()
 
@@ -384,12 +949,36 @@ class UpdateList(Gtk.TreeView):
 		Fired when a status checkbutton has been toggled.
 		"""
 		
-		itr = self.model.get_iter(path)
+		itr = self.model.get_iter(self.get_store_path(Gtk.TreePath(path)))
 		
 		id = self.model.get_value(itr, 3)
 		reason = self.model.get_value(itr, 0)
 		status = self.model.get_value(itr, 1)
 		
+		if id == -1:
+			# Section: select every package, or none if they are all
+			# selected already. While searching, only the packages
+			# shown are affected, hidden ones can't be reviewed.
+			children = []
+			child = self.model.iter_children(itr)
+			while child is not None:
+				if self.model.get_value(child, 10):
+					children.append(child)
+				
+				child = self.model.iter_next(child)
+			
+			status = not all(self.model.get_value(child, 1) for child in children)
+			
+			for child in children:
+				if self.model.get_value(child, 1) != status:
+					self.emit(
+						"status-toggled",
+						self.model.get_value(child, 3),
+						self.model.get_value(child, 0) if status else "keep"
+					)
+			
+			return
+		
 		if status:
 			# Current status is True, so the user wants to set it to False
 			reason = "keep"
@@ -22,9 +22,11 @@
 __all__ = [
 	"UpdateList",
 	"UpdateItem",
-	"CircularProgressBar"
+	"CircularProgressBar",
+	"HistoryDialog"
 ]
 
 from .UpdateList import UpdateList
 from .UpdateItem import UpdateItem
 from .CircularProgressBar import CircularProgressBar
+from .HistoryDialog import HistoryDialog
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+A stand-in for channels' updates object, exported on a private bus.
+
+The tests that talk to channels import everything from here: if gi or
+dbus-daemon are not available, AVAILABLE is False and they are skipped.
+"""
+
+import os
+import time
+import atexit
+import shutil
+import builtins
+import threading
+import tempfile
+import collections
+
+# The modules use the gettext builtin, and the handler needs it at
+# import time
+if not hasattr(builtins, "_"):
+	builtins._ = lambda text: text
+
+try:
+	from gi.repository import GLib, Gio
+except ImportError:
+	GLib = Gio = None
+
+AVAILABLE = (Gio is not None and shutil.which("dbus-daemon") is not None)
+
+BUS_NAME = "org.semplicelinux.channels"
+IFACE = "org.semplicelinux.channels.updates"
+UPDATES_PATH = "/org/semplicelinux/channels/updates"
+
+INTROSPECTION = """
+<node>
+	<interface name="org.semplicelinux.channels.updates">
+		<method name="CheckUpdates">
+			<arg type="b" direction="in"/>
+			<arg type="b" direction="in"/>
+		</method>
+		<method name="ChangeStatus">
+			<arg type="i" direction="in"/>
+			<arg type="s" direction="in"/>
+		</method>
+		<method name="GetUpdateInfos">
+			<arg type="s" direction="out"/>
+			<arg type="s" direction="out"/>
+		</method>
+		<method name="Refresh"/>
+		<method name="Fetch"/>
+		<method name="FetchStop"/>
+		<property name="Refreshing" type="b" access="read"/>
+		<property name="Downloading" type="b" access="read"/>
+		<property name="CacheOpening" type="b" access="read"/>
+		<property name="Checking" type="b" access="read"/>
+		<property name="Installing" type="b" access="read"/>
+		<property name="CacheFailure" type="b" access="read"/>
+	</interface>
+</node>
+"""
+
+# The private bus, shared by every test of the process (GIO keeps a
+# single system bus connection around)
+_bus = None
+_cache = None
+
+def get_bus_address():
+	"""
+	Starts the private bus the first time, and returns its address.
+	
+	The modules connect to the system bus, which is redirected here.
+	"""
+	
+	global _bus, _cache
+	
+	if _bus is None:
+		# Don't touch the real durations store
+		_cache = tempfile.TemporaryDirectory()
+		os.environ["XDG_CACHE_HOME"] = _cache.name
+		
+		_bus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+		_bus.up()
+		atexit.register(_bus.down)
+		atexit.register(_cache.cleanup)
+		
+		os.environ["DBUS_SYSTEM_BUS_ADDRESS"] = _bus.get_bus_address()
+	
+	return _bus.get_bus_address()
+
+def run_until(predicate, timeout=5):
+	"""
+	Iterates the default main context until `predicate` returns True.
+	
+	Raises AssertionError if that didn't happen in `timeout` seconds.
+	"""
+	
+	context = GLib.MainContext.default()
+	deadline = time.monotonic() + timeout
+	
+	# Never block for long, so that the deadline is honoured
+	source = GLib.timeout_add(10, lambda: True)
+	try:
+		while not predicate():
+			if time.monotonic() > deadline:
+				raise AssertionError("Timed out")
+			
+			context.iteration(True)
+	finally:
+		GLib.source_remove(source)
+
+def run_for(seconds):
+	"""
+	Iterates the default main context for `seconds`.
+	"""
+	
+	deadline = time.monotonic() + seconds
+	
+	try:
+		run_until(lambda: time.monotonic() > deadline, seconds + 5)
+	except AssertionError:
+		pass
+
+class Channels:
+	
+	"""
+	The stand-in service.
+	
+	It runs in its own thread, with its own main context, so that it
+	keeps replying while the main loop is blocked (e.g. by a synchronous
+	call).
+	
+	`delay` is how long (in milliseconds) every method call takes to be
+	replied. Method calls are recorded in `calls`, and property reads
+	(through Get or GetAll) are counted in `reads`.
+	"""
+	
+	def __init__(self, delay=0):
+		"""
+		Initializes the class.
+		"""
+		
+		self.delay = delay
+		
+		self.properties = {
+			"Refreshing" : False,
+			"Downloading" : False,
+			"CacheOpening" : False,
+			"Checking" : False,
+			"Installing" : False,
+			"CacheFailure" : False,
+		}
+		
+		self.calls = []
+		self.reads = collections.Counter()
+		
+		self.context = GLib.MainContext()
+		self.loop = GLib.MainLoop(self.context)
+		
+		ready = threading.Event()
+		self.thread = threading.Thread(target=self.run, args=(ready,), daemon=True)
+		self.thread.start()
+		ready.wait()
+	
+	def run(self, ready):
+		"""
+		Exports the object, and runs the service main loop.
+		"""
+		
+		self.context.push_thread_default()
+		
+		self.connection = Gio.DBusConnection.new_for_address_sync(
+			get_bus_address(),
+			Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION,
+			None,
+			None
+		)
+		
+		info = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION).interfaces[0]
+		self.registration = self.connection.register_object(
+			UPDATES_PATH,
+			info,
+			self.on_method_call,
+			self.on_get_property,
+			None
+		)
+		
+		self.own_name()
+		
+		ready.set()
+		self.loop.run()
+		
+		self.context.pop_thread_default()
+	
+	def _bus_call(self, method, name):
+		"""
+		Calls `method` of the bus daemon with `name`.
+		"""
+		
+		self.connection.call_sync(
+			"org.freedesktop.DBus",
+			"/org/freedesktop/DBus",
+			"org.freedesktop.DBus",
+			method,
+			GLib.Variant("(su)", (name, 0)) if method == "RequestName" else GLib.Variant("(s)", (name,)),
+			None,
+			Gio.DBusCallFlags.NONE,
+			-1,
+			None
+		)
+	
+	def own_name(self):
+		"""
+		Takes the channels bus name (e.g. after a simulated restart).
+		"""
+		
+		self._bus_call("RequestName", BUS_NAME)
+	
+	def release_name(self):
+		"""
+		Gives the channels bus name up, as if channels exited.
+		"""
+		
+		self._bus_call("ReleaseName", BUS_NAME)
+	
+	def close(self):
+		"""
+		Stops the service.
+		"""
+		
+		self.release_name()
+		self.connection.unregister_object(self.registration)
+		
+		self.loop.quit()
+		self.thread.join()
+		
+		self.connection.close_sync(None)
+	
+	def on_method_call(self, connection, sender, path, interface, method, params, invocation):
+		"""
+		Replies to a method call, after `delay` milliseconds.
+		"""
+		
+		self.calls.append((method, params.unpack()))
+		
+		if method == "GetUpdateInfos":
+			value = GLib.Variant("(ss)", ("0 B", "0 B"))
+		else:
+			value = None
+		
+		def reply(*args):
+			invocation.return_value(value)
+			return False
+		
+		if self.delay:
+			source = GLib.Timeout(self.delay)
+			source.set_callback(reply)
+			source.attach(self.context)
+		else:
+			reply()
+	
+	def on_get_property(self, connection, sender, path, interface, name):
+		"""
+		Returns the value of the property `name`.
+		"""
+		
+		self.reads[name] += 1
+		
+		return GLib.Variant("b", self.properties[name])
+	
+	def set_properties(self, **properties):
+		"""
+		Changes some properties, and sends PropertiesChanged.
+		"""
+		
+		self.properties.update(properties)
+		
+		self.connection.emit_signal(
+			None,
+			UPDATES_PATH,
+			"org.freedesktop.DBus.Properties",
+			"PropertiesChanged",
+			GLib.Variant(
+				"(sa{sv}as)",
+				(
+					IFACE,
+					{name : GLib.Variant("b", value) for name, value in properties.items()},
+					[]
+				)
+			)
+		)
+	
+	def emit(self, signal, signature=None, *args):
+		"""
+		Emits the DBus signal `signal` with `args`.
+		"""
+		
+		self.connection.emit_signal(
+			None,
+			UPDATES_PATH,
+			IFACE,
+			signal,
+			GLib.Variant(signature, args) if signature else None
+		)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import codecs
+import unittest
+from unittest import mock
+
+from modules.updates.core.aptlog import AptLogParser
+
+LOG = (
+	b"Unpacking foo (1.0) ...\n"
+	b"Garbled output \xff\xfe\n"
+	b"Setting up b\xc3\xa4r (2.0) ...\n"
+	b"Setting up foo (1.0) ...\n"
+)
+
+def chunks(data, size):
+	"""
+	Splits `data` like the followers do, yielding (text, start, end)
+	tuples.
+	"""
+	
+	decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+	decoded = 0
+	
+	for start in range(0, len(data), size):
+		text = decoder.decode(data[start:start + size])
+		if text:
+			chunk_start, decoded = decoded, start + len(data[start:start + size]) - len(decoder.getstate()[0])
+			yield text, chunk_start, decoded
+
+class TestAptLogParser(unittest.TestCase):
+	
+	def feed(self, parser, data, size, inode=1):
+		for text, start, end in chunks(data, size):
+			parser.feed(text, inode, start, end)
+	
+	def test_offsets(self):
+		# No phase line follows the invalid bytes in the same chunk
+		for size in (1, 5, 13, 41):
+			with self.subTest(size=size):
+				parser = AptLogParser()
+				self.feed(parser, LOG, size)
+				
+				# Exact, despite the invalid and the split sequences
+				self.assertEqual(parser.packages["foo"].phases["unpack"][1], 0)
+				self.assertEqual(parser.packages["b\xe4r"].phases["setup"][1], LOG.index(b"Setting up b"))
+				self.assertEqual(parser.packages["foo"].phases["setup"][1], LOG.index(b"Setting up foo"))
+				self.assertEqual(parser.packages["foo"].phases["setup"][2], 3)
+	
+	def test_offsets_after_invalid_chunk(self):
+		parser = AptLogParser()
+		
+		# Positions are measured on the text in the first chunk, but
+		# the next one starts from the right place
+		split = LOG.index(b"Setting up foo")
+		parser.feed(LOG[:split].decode("utf-8", errors="replace"), 1, 0, split)
+		parser.feed(LOG[split:].decode("utf-8"), 1, split, len(LOG))
+		
+		self.assertEqual(parser.packages["foo"].phases["setup"][1], split)
+		self.assertEqual(parser.offset, len(LOG))
+	
+	def test_truncation(self):
+		parser = AptLogParser()
+		self.feed(parser, LOG, 7)
+		
+		# Written again from the start
+		self.feed(parser, b"Unpacking baz (1.0) ...\n", 7)
+		
+		self.assertEqual(list(parser.packages), ["baz"])
+	
+	def test_no_spurious_reset(self):
+		parser = AptLogParser()
+		
+		# Everything up to the invalid bytes, then the rest
+		split = LOG.index(b"Setting")
+		self.feed(parser, LOG[:split], split)
+		parser.feed(LOG[split:].decode("utf-8"), 1, split, len(LOG))
+		
+		self.assertEqual(sorted(parser.packages), ["b\xe4r", "foo"])
+		self.assertEqual(parser.completed_names, ["b\xe4r", "foo"])
+
+	def test_stage_times(self):
+		parser = AptLogParser()
+		
+		# apt unpacks everything first, then configures
+		lines = (
+			(0, "Unpacking foo (1.0) ...\n"),
+			(1, "Unpacking bar (2.0) ...\n"),
+			(3, "Setting up foo (1.0) ...\n"),
+			(4, "Setting up bar (2.0) ...\n"),
+		)
+		
+		with mock.patch("modules.updates.core.aptlog.time") as clock:
+			for timestamp, line in lines:
+				clock.time.return_value = timestamp
+				parser.feed(line)
+			
+			parser.charge(10)
+		
+		foo, bar = parser.packages["foo"], parser.packages["bar"]
+		
+		self.assertEqual((foo.unpack_time, foo.configure_time), (1, 1))
+		self.assertEqual((bar.unpack_time, bar.configure_time), (2, 6))
+		self.assertEqual(foo.duration, 2)
+		self.assertEqual(parser.unpacked_names, ["foo", "bar"])
+
+if __name__ == "__main__":
+	unittest.main()
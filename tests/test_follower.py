@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import time
+import queue
+import select
+import tempfile
+import threading
+import unittest
+
+try:
+	from modules.updates.core import common
+except ImportError:
+	# gi is not available
+	common = None
+
+class FollowerTests:
+	
+	"""
+	Tests shared by every Follower implementation.
+	"""
+	
+	# Maximum time for an append to be picked up
+	LATENCY = 1.5
+	
+	def new_follower(self, path, offset=0):
+		raise NotImplementedError
+	
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, "term.log")
+		
+		with open(self.path, "w") as f:
+			f.write("Log started\n")
+		
+		self.chunks = queue.Queue()
+		self.follower = self.new_follower(self.path)
+		self.thread = threading.Thread(target=self.run_follower, daemon=True)
+		self.thread.start()
+		
+		self.assertEqual(self.read(), "Log started\n")
+	
+	def tearDown(self):
+		self.follower.stop()
+		self.thread.join(5)
+		self.directory.cleanup()
+	
+	def run_follower(self):
+		for chunk in self.follower:
+			self.chunks.put(chunk)
+	
+	def append(self, text, path=None):
+		with open(path or self.path, "a") as f:
+			f.write(text)
+	
+	def read(self, timeout=None):
+		"""
+		Returns the next chunk yielded by the follower.
+		"""
+		
+		return self.chunks.get(timeout=timeout or self.LATENCY)
+	
+	def test_append_latency(self):
+		start = time.monotonic()
+		self.append("Unpacking foo (1.0) ...\n")
+		
+		self.assertEqual(self.read(), "Unpacking foo (1.0) ...\n")
+		self.assertLess(time.monotonic() - start, self.LATENCY)
+	
+	def test_rotation(self):
+		os.rename(self.path, self.path + ".1")
+		self.append("Log restarted\n")
+		
+		self.assertEqual(self.read(), "Log restarted\n")
+		self.assertNotEqual(self.follower.inode, os.stat(self.path + ".1").st_ino)
+	
+	def test_truncation(self):
+		with open(self.path, "w") as f:
+			f.write("New\n")
+		
+		self.assertEqual(self.read(), "New\n")
+		self.assertEqual(self.follower.position, 4)
+	
+	def test_chunk_offsets(self):
+		# "é" split across two writes, and an invalid byte
+		with open(self.path, "ab") as f:
+			f.write(b"\xc3")
+			f.flush()
+			time.sleep(self.LATENCY / 3)
+			f.write(b"\xa9\xff\n")
+		
+		text = self.read()
+		while not text.endswith("\n"):
+			text += self.read()
+		
+		self.assertEqual(text, "\xe9\ufffd\n")
+		self.assertEqual(self.follower.chunk_end, len(b"Log started\n\xc3\xa9\xff\n"))
+	
+	def test_stop_latency(self):
+		start = time.monotonic()
+		self.follower.stop()
+		self.thread.join(5)
+		
+		self.assertFalse(self.thread.is_alive())
+		self.assertLess(time.monotonic() - start, 0.5)
+	
+	def test_stop_after_close(self):
+		self.follower.stop()
+		self.thread.join(5)
+		
+		# The wakeup pipe is gone, and its descriptors may be reused
+		read, write = os.pipe()
+		try:
+			self.follower.stop()
+			self.follower._close()
+			
+			readable, _w, _x = select.select([read], [], [], 0)
+			self.assertEqual(readable, [])
+		finally:
+			os.close(read)
+			os.close(write)
+	
+	def test_no_leak_on_failure(self):
+		descriptors = len(os.listdir("/proc/self/fd"))
+		
+		with self.assertRaises(FileNotFoundError):
+			self.new_follower(os.path.join(self.directory.name, "missing.log"))
+		
+		self.assertEqual(len(os.listdir("/proc/self/fd")), descriptors)
+
+@unittest.skipIf(common is None, "gi is not available")
+class TestReadMapped(unittest.TestCase):
+	
+	def test_offsets(self):
+		data = "Setting up b\xe4r ...\n".encode("utf-8") + b"\xff\n"
+		
+		with tempfile.NamedTemporaryFile() as f:
+			f.write(data)
+			f.flush()
+			
+			# The first slice ends in the middle of "ä"
+			slices = list(common.read_mapped(f.name, size=13))
+		
+		self.assertEqual("".join(text for text, inode, start, end in slices), "Setting up b\xe4r ...\n\ufffd\n")
+		self.assertEqual(slices[0][2:], (0, 12))
+		self.assertEqual(slices[1][2:], (12, len(data)))
+
+@unittest.skipIf(common is None, "gi is not available")
+class TestFollower(FollowerTests, unittest.TestCase):
+	
+	def new_follower(self, path, offset=0):
+		return common.Follower(path, offset)
+
+@unittest.skipIf(common is None or not common.INOTIFY_AVAILABLE, "inotify is not available")
+class TestInotifyFollower(FollowerTests, unittest.TestCase):
+	
+	LATENCY = 0.5
+	
+	def new_follower(self, path, offset=0):
+		return common.InotifyFollower(path, offset)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+import unittest
+
+from . import service
+
+if service.AVAILABLE:
+	from gi.repository import GLib
+	
+	from modules.updates.core.handler import UpdateHandler
+
+class HandlerTests:
+	
+	"""
+	Connects an UpdateHandler to a stand-in channels.
+	"""
+	
+	# How long channels takes to reply to method calls, in milliseconds
+	DELAY = 0
+	
+	def setUp(self):
+		self.channels = service.Channels(self.DELAY)
+		self.handler = UpdateHandler()
+		
+		self.failures = []
+		self.handler.connect(
+			"generic-failure",
+			lambda handler, error, description: self.failures.append(description)
+		)
+		
+		service.run_until(lambda: self.handler.props.connected)
+	
+	def tearDown(self):
+		self.handler.cancel()
+		self.channels.close()
+
+@unittest.skipUnless(service.AVAILABLE, "gi or dbus-daemon are not available")
+class TestStartup(unittest.TestCase):
+	
+	def setUp(self):
+		self.channels = service.Channels()
+	
+	def tearDown(self):
+		self.channels.close()
+	
+	def test_startup(self):
+		start = time.monotonic()
+		handler = UpdateHandler()
+		constructed = time.monotonic() - start
+		
+		self.assertFalse(handler.props.connected)
+		
+		service.run_until(lambda: handler.props.connected)
+		connected = time.monotonic() - start
+		
+		print(
+			"\nUpdateHandler constructed in %.1fms, connected in %.1fms" % (
+				constructed * 1000, connected * 1000
+			)
+		)
+		
+		# The scene can paint right away, the proxies come later
+		self.assertLess(constructed, 0.05)
+		
+		handler.cancel()
+
+@unittest.skipUnless(service.AVAILABLE, "gi or dbus-daemon are not available")
+class TestSlowService(HandlerTests, unittest.TestCase):
+	
+	DELAY = 2000
+	
+	def test_main_loop_responsive(self):
+		# Record when the main loop gets to run
+		ticks = []
+		source = GLib.timeout_add(10, lambda: ticks.append(time.monotonic()) or True)
+		
+		try:
+			start = time.monotonic()
+			
+			self.handler.check()
+			self.handler.refresh()
+			self.handler.change_status(1, "install")
+			self.handler.flush_status_changes()
+			
+			# Nothing waits for the replies
+			self.assertLess(time.monotonic() - start, 0.1)
+			
+			service.run_for(self.DELAY / 1000.0 + 0.5)
+		finally:
+			GLib.source_remove(source)
+		
+		self.assertEqual(
+			sorted(method for method, params in self.channels.calls),
+			["ChangeStatus", "CheckUpdates", "Refresh"]
+		)
+		self.assertEqual(self.failures, [])
+		
+		# The main loop kept running while channels was busy
+		gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+		self.assertGreater(len(ticks), 50)
+		self.assertLess(max(gaps), 0.25)
+	
+	def test_call_timeout(self):
+		self.handler.call_timeouts = {"CheckUpdates" : 100}
+		
+		start = time.monotonic()
+		self.handler.check()
+		service.run_until(lambda: self.failures, self.DELAY / 1000.0)
+		
+		# Failed on its own timeout, reported through generic-failure
+		self.assertLess(time.monotonic() - start, self.DELAY / 1000.0)
+		self.assertEqual(len(self.failures), 1)
+
+@unittest.skipUnless(service.AVAILABLE, "gi or dbus-daemon are not available")
+class TestPropertyReads(HandlerTests, unittest.TestCase):
+	
+	PROPERTIES = (
+		"refreshing",
+		"downloading",
+		"cache-opening",
+		"checking",
+		"installing",
+		"cache-failure",
+		"cache-operation",
+		"download-operation",
+	)
+	
+	def setUp(self):
+		super().setUp()
+		
+		# Read every property on every notify, as the scene bindings do
+		for name in self.PROPERTIES:
+			self.handler.connect("notify::%s" % name, self.read_all)
+		
+		service.run_for(0.1)
+		self.channels.reads.clear()
+	
+	def read_all(self, *args):
+		for name in self.PROPERTIES:
+			self.handler.get_property(name)
+	
+	def test_properties_changed(self):
+		for i in range(10):
+			self.channels.set_properties(Refreshing=True, CacheOpening=True)
+			self.channels.set_properties(Refreshing=False, CacheOpening=False, Checking=True)
+			self.channels.set_properties(Checking=False)
+		
+		service.run_until(lambda: not self.handler.props.cache_operation)
+		service.run_for(0.2)
+		
+		# Everything came from the mirror
+		self.assertEqual(sum(self.channels.reads.values()), 0)
+	
+	def test_state_signals(self):
+		bursts = 10
+		
+		for i in range(bursts):
+			self.channels.emit("UpdateCheckStarted")
+			self.channels.emit("UpdateCheckStopped")
+			service.run_for(0.05)
+		
+		# The only thing not implied by the signals is CacheFailure,
+		# fetched again at most once per burst
+		self.assertEqual(set(self.channels.reads), {"CacheFailure"})
+		self.assertLessEqual(self.channels.reads["CacheFailure"], bursts)
+		self.assertFalse(self.handler.props.checking)
+
+@unittest.skipUnless(service.AVAILABLE, "gi or dbus-daemon are not available")
+class TestStateSignals(HandlerTests, unittest.TestCase):
+	
+	def setUp(self):
+		super().setUp()
+		
+		self.notified = []
+		for name in ("refreshing", "checking", "installing", "cache-operation"):
+			self.handler.connect("notify::%s" % name, self.on_notify)
+		
+		# Let the initial notifications go out
+		service.run_for(0.1)
+		self.notified.clear()
+	
+	def on_notify(self, handler, param):
+		self.notified.append(param.name)
+	
+	def replay(self, *signals):
+		"""
+		Delivers `signals` within the same main loop iteration.
+		"""
+		
+		for signal in signals:
+			self.handler.on_dbus_signal_changed(None, None, signal, ())
+		
+		service.run_for(0.1)
+	
+	def test_check_failed(self):
+		self.channels.properties["CacheFailure"] = True
+		
+		self.replay("UpdateCheckStarted", "UpdateCheckFailed")
+		
+		self.assertIn("checking", self.notified)
+		self.assertIn("cache-operation", self.notified)
+		self.assertFalse(self.handler.props.checking)
+		self.assertEqual(self.handler.props.status_scene, "error")
+	
+	def test_refresh(self):
+		self.replay("CacheUpdateStarted", "CacheUpdateStopped")
+		
+		self.assertIn("refreshing", self.notified)
+		self.assertIn("cache-operation", self.notified)
+		self.assertEqual(self.handler.props.status_scene, "up-to-date")
+	
+	def test_unchanged(self):
+		# Nothing flipped, nothing to notify
+		self.replay("PackageInstallFinished")
+		
+		self.assertEqual(self.notified, [])
+
+@unittest.skipUnless(service.AVAILABLE, "gi or dbus-daemon are not available")
+class TestSignalReplay(HandlerTests, unittest.TestCase):
+	
+	SIGNALS = (
+		"CacheUpdateStarted",
+		"CacheUpdateStopped",
+		"UpdateCheckStarted",
+		"UpdateCheckStopped",
+	)
+	
+	# Total signals, and how many are delivered per main loop iteration
+	COUNT = 10000
+	BURST = 100
+	
+	def test_replay(self):
+		notified = []
+		self.handler.connect("notify", lambda handler, param: notified.append(param.name))
+		
+		service.run_for(0.1)
+		notified.clear()
+		self.channels.reads.clear()
+		context = GLib.MainContext.default()
+		
+		start = time.monotonic()
+		for i in range(self.COUNT):
+			signal = self.SIGNALS[i % len(self.SIGNALS)]
+			self.handler.on_dbus_signal_changed(None, None, signal, ())
+			
+			if i % self.BURST == self.BURST - 1:
+				while context.pending():
+					context.iteration(False)
+		elapsed = time.monotonic() - start
+		
+		notifies = len(notified) / self.COUNT
+		reads = sum(self.channels.reads.values()) / self.COUNT
+		
+		print(
+			"\n%d signals in %.3fs: %.3f notifies and %.4f DBus reads per signal" % (
+				self.COUNT, elapsed, notifies, reads
+			)
+		)
+		
+		# Every burst is notified once, not once per signal
+		self.assertLess(notifies, 1)
+		self.assertLessEqual(reads, 1 / self.BURST)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import gzip
+import tempfile
+import unittest
+
+from modules.updates.core.history import LogHistory, OUTCOME_COMPLETED
+
+RUN = b"""Log started: %s
+Unpacking foo (1.0) ...
+Setting up foo (1.0) ...
+Log ended: %s
+"""
+
+class TestLogHistory(unittest.TestCase):
+	
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, "systemupdate.log")
+		
+		with open(self.path, "wb") as f:
+			f.write(RUN % (b"3", b"3"))
+		
+		with open(self.path + ".1", "wb") as f:
+			f.write(RUN % (b"2", b"2"))
+	
+	def tearDown(self):
+		self.directory.cleanup()
+	
+	def test_runs(self):
+		with gzip.open(self.path + ".2.gz", "wb") as f:
+			f.write(RUN % (b"1", b"1"))
+		
+		runs = list(LogHistory(self.path).get_runs())
+		
+		self.assertEqual([run.started for run in runs], ["3", "2", "1"])
+		self.assertEqual({run.outcome for run in runs}, {OUTCOME_COMPLETED})
+		self.assertEqual("".join(runs[2].read()), (RUN % (b"1", b"1")).decode())
+	
+	def test_corrupted_gzip(self):
+		data = bytearray(gzip.compress(RUN % (b"1", b"1") * 100))
+		
+		# Garble the deflate stream, leaving the gzip header alone
+		data[20:40] = b"\xff" * 20
+		with open(self.path + ".2.gz", "wb") as f:
+			f.write(data)
+		
+		with open(self.path + ".3", "wb") as f:
+			f.write(RUN % (b"0", b"0"))
+		
+		runs = list(LogHistory(self.path).get_runs())
+		
+		# Nothing could be read from the corrupted log, but the older
+		# ones are still indexed
+		self.assertEqual([run.started for run in runs], ["3", "2", "0"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Benchmarks for the delivery of the APT log to the details view.
+
+Run them with -s to see the timings.
+"""
+
+import os
+import time
+import tempfile
+import threading
+import unittest
+import collections
+
+try:
+	from gi.repository import GLib, Gtk
+	
+	from modules.updates.core import common
+except ImportError:
+	# gi (or GTK+) is not available
+	common = None
+
+# Lines in the synthetic log
+LINES = 50000
+
+def write_log(path, lines=LINES):
+	"""
+	Writes a synthetic systemupdate.log of roughly `lines` lines, and
+	returns its size.
+	"""
+	
+	with open(path, "w") as f:
+		f.write("Log started: 2015-01-01  00:00:00\n")
+		
+		for package in range(lines // 5):
+			f.write(
+				"Preparing to unpack .../package-%(id)d_1.0-%(id)d_amd64.deb ...\n"
+				"Unpacking package-%(id)d (1.0-%(id)d) over (0.9) ...\n"
+				"Selecting previously unselected package package-%(id)d.\n"
+				"Setting up package-%(id)d (1.0-%(id)d) ...\n"
+				"Processing triggers for man-db (2.7.0.2-5) ...\n" % {"id" : package}
+			)
+		
+		f.write("Log ended: 2015-01-01  00:10:00\n")
+		
+		return f.tell()
+
+class LogTests:
+	
+	"""
+	Writes the synthetic log, and dumps it into a TextBuffer.
+	"""
+	
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, "systemupdate.log")
+		self.size = write_log(self.path)
+		
+		self.buffer = Gtk.TextBuffer()
+		self.inserts = 0
+	
+	def tearDown(self):
+		self.directory.cleanup()
+	
+	def insert(self, text):
+		self.buffer.insert(self.buffer.get_end_iter(), text)
+		self.inserts += 1
+	
+	def run_loop(self, done):
+		"""
+		Runs the main loop until `done` returns True, and returns how
+		long it took.
+		"""
+		
+		context = GLib.MainContext.default()
+		
+		start = time.monotonic()
+		while not done():
+			context.iteration(True)
+		
+		return time.monotonic() - start
+
+@unittest.skipIf(common is None, "gi or GTK+ are not available")
+class TestChunkedDelivery(LogTests, unittest.TestCase):
+	
+	# How often the details are flushed, as the frame clock would
+	FRAME = 16
+	
+	def test_follower(self):
+		pending = collections.deque()
+		
+		follower = common.new_follower(self.path)
+		
+		def read():
+			# Like follow_log(): the reader thread only queues the text
+			for chunk in follower:
+				pending.append((chunk, follower.inode, follower.chunk_start, follower.chunk_end))
+		
+		# Byte offset right after the text inserted so far
+		flushed = [0]
+		
+		def flush():
+			# Like flush_details(): one insert with everything queued
+			chunks = []
+			while pending:
+				text, inode, start, end = pending.popleft()
+				chunks.append(text)
+				flushed[0] = end
+			
+			if chunks:
+				self.insert("".join(chunks))
+			
+			return True
+		
+		source = GLib.timeout_add(self.FRAME, flush)
+		thread = threading.Thread(target=read, daemon=True)
+		thread.start()
+		
+		try:
+			elapsed = self.run_loop(lambda: flushed[0] == self.size)
+		finally:
+			follower.stop()
+			thread.join(5)
+			GLib.source_remove(source)
+		
+		print(
+			"\n%d lines (%d bytes) followed in %.3fs, with %d inserts" % (
+				LINES, self.size, elapsed, self.inserts
+			)
+		)
+		
+		self.assertEqual(self.buffer.get_line_count(), LINES + 3)
+		self.assertLess(self.inserts, LINES / 100)
+
+@unittest.skipIf(common is None, "gi or GTK+ are not available")
+class TestCompletedDump(LogTests, unittest.TestCase):
+	
+	def dump_lines(self):
+		"""
+		The old path: one idle callback per line.
+		"""
+		
+		pending = [0]
+		
+		def insert(line):
+			self.insert(line)
+			pending[0] -= 1
+			return False
+		
+		with open(self.path, "r", errors="replace") as f:
+			for line in f:
+				pending[0] += 1
+				GLib.idle_add(insert, line)
+		
+		return pending
+	
+	def dump_mapped(self):
+		"""
+		The dump_log() path: a memory-mapped slice per main loop
+		iteration.
+		"""
+		
+		pending = [1]
+		slices = common.read_mapped(self.path)
+		
+		def insert():
+			try:
+				text, inode, start, end = next(slices)
+			except StopIteration:
+				pending[0] = 0
+				return False
+			
+			self.insert(text)
+			return True
+		
+		GLib.idle_add(insert)
+		
+		return pending
+	
+	def test_mapped_vs_lines(self):
+		results = {}
+		
+		for path in ("lines", "mapped"):
+			self.buffer.set_text("")
+			self.inserts = 0
+			
+			start = time.monotonic()
+			pending = getattr(self, "dump_%s" % path)()
+			self.run_loop(lambda: pending[0] == 0)
+			
+			results[path] = (time.monotonic() - start, self.inserts)
+			
+			self.assertEqual(self.buffer.get_line_count(), LINES + 3)
+		
+		print(
+			"\n%d bytes dumped in %.3fs line by line (%d inserts), in %.3fs mapped (%d inserts)" % (
+				self.size, results["lines"][0], results["lines"][1], results["mapped"][0], results["mapped"][1]
+			)
+		)
+		
+		self.assertLess(results["mapped"][0], results["lines"][0])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+from unittest import mock
+
+try:
+	from modules.updates.core.common import RateEstimator
+except ImportError:
+	# gi is not available
+	RateEstimator = None
+
+@unittest.skipIf(RateEstimator is None, "gi is not available")
+class TestRateEstimator(unittest.TestCase):
+	
+	def setUp(self):
+		patcher = mock.patch("modules.updates.core.common.time")
+		self.clock = patcher.start()
+		self.addCleanup(patcher.stop)
+		
+		self.now = 0.0
+		self.clock.monotonic.side_effect = lambda: self.now
+		
+		self.estimator = RateEstimator(window=5.0, stale_after=10.0)
+		self.estimator.reset(10000)
+	
+	def complete(self, at, size):
+		self.now = at
+		self.estimator.add(size)
+		return self.estimator.update()
+	
+	def poll(self, at):
+		self.now = at
+		return self.estimator.update()
+	
+	def test_hold_between_completions(self):
+		self.assertEqual(self.complete(1, 1000), 1000)
+		
+		# The next package is still being downloaded
+		for at in (1.5, 2, 2.5, 3):
+			self.assertEqual(self.poll(at), 1000)
+		
+		# Measured since the previous completion
+		self.assertEqual(self.complete(4, 3000), 1000)
+		self.assertEqual(self.estimator.eta, 6)
+	
+	def test_stale(self):
+		self.complete(1, 1000)
+		
+		self.assertEqual(self.poll(11), 1000)
+		self.assertIsNone(self.poll(11.5))
+		
+		# Back once something completes
+		self.assertIsNotNone(self.complete(12, 1000))
+	
+	def test_nothing_yet(self):
+		self.assertIsNone(self.poll(1))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+import unittest
+
+try:
+	from modules.updates.widgets.UpdateList import RowIndex
+except ImportError:
+	# gi (or GTK+) is not available
+	RowIndex = None
+
+# Number of packages indexed
+COUNT = 10000
+
+@unittest.skipIf(RowIndex is None, "GTK+ is not available")
+class TestRowIndex(unittest.TestCase):
+	
+	def setUp(self):
+		# The iters are opaque to the index, plain objects will do
+		self.names = ["lib%s-%d" % (prefix, id) for id, prefix in zip(
+			range(COUNT),
+			("foo", "bar", "baz", "qux") * (COUNT // 4)
+		)]
+		
+		self.index = RowIndex()
+		for id, name in enumerate(self.names):
+			self.index.add(id, name, object())
+	
+	def test_add(self):
+		self.assertEqual(len(self.index), COUNT)
+		self.assertEqual(self.index.sorted_names, sorted(self.names))
+		self.assertIn(COUNT - 1, self.index)
+		self.assertNotIn(COUNT, self.index)
+	
+	def test_get_id(self):
+		for id, name in enumerate(self.names):
+			self.assertEqual(self.index.get_id(name), id)
+		
+		self.assertIsNone(self.index.get_id("missing"))
+	
+	def test_remove(self):
+		itr = self.index.get_iter(42)
+		self.index.downloading.add(42)
+		
+		self.assertIs(self.index.remove(42), itr)
+		self.assertIsNone(self.index.remove(42))
+		
+		self.assertEqual(len(self.index), COUNT - 1)
+		self.assertIsNone(self.index.get_id(self.names[42]))
+		self.assertNotIn(self.names[42], self.index.sorted_names)
+		self.assertNotIn(42, self.index.downloading)
+	
+	def test_readd(self):
+		# A package moved to another id keeps a single sorted name
+		self.index.add(COUNT, self.names[0], object())
+		self.index.remove(0)
+		
+		self.assertEqual(self.index.get_id(self.names[0]), COUNT)
+		self.assertEqual(self.index.sorted_names.count(self.names[0]), 1)
+	
+	def test_find_prefix(self):
+		for prefix in ("", "lib", "libfoo", "libbar-1", "libqux-9999", "libz", "z"):
+			self.assertEqual(
+				sorted(self.index.find_prefix(prefix)),
+				[id for id, name in enumerate(self.names) if name.startswith(prefix)]
+			)
+	
+	def test_find_prefix_speed(self):
+		# A binary search, not a scan: a thousand lookups of a few
+		# matches each are way cheaper than a single pass over the names
+		start = time.perf_counter()
+		for id in range(0, COUNT, COUNT // 1000):
+			self.index.find_prefix(self.names[id])
+		
+		self.assertLess(time.perf_counter() - start, 0.5)
+
+if __name__ == "__main__":
+	unittest.main()
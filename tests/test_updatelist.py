@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# updates - Semplice update preferences
+# Copyright (C) 2015  Eugenio "g7" Paolantonio
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import sys
+import time
+import builtins
+import unittest
+
+# The section labels are translated
+if not hasattr(builtins, "_"):
+	builtins._ = lambda text: text
+
+try:
+	from gi.repository import Gtk
+	
+	# Needs a display (e.g. Xvfb)
+	DISPLAY = Gtk.init_check(sys.argv)[0]
+except (ImportError, ValueError):
+	DISPLAY = False
+
+if DISPLAY:
+	from modules.updates.widgets.UpdateList import UpdateList
+	
+	from modules.updates.core.handler import UpdateHandler
+
+REASONS = ("upgrade", "install", "remove", "upgrade")
+
+def get_updates(count):
+	"""
+	Returns `count` updates, as sent by updates-found.
+	"""
+	
+	return [
+		(id, "package-%05d" % id, "1.0-%d" % id, REASONS[id % 4], True, "%d kB" % id)
+		for id in range(count)
+	]
+
+def iterate():
+	"""
+	Handles everything pending, drawing included.
+	"""
+	
+	while Gtk.events_pending():
+		Gtk.main_iteration()
+
+class ListTests:
+	
+	"""
+	Shows an UpdateList in a window.
+	"""
+	
+	def setUp(self):
+		self.list = UpdateList()
+		
+		self.window = Gtk.Window()
+		self.window.set_default_size(600, 400)
+		
+		scrolled = Gtk.ScrolledWindow()
+		scrolled.add(self.list)
+		self.window.add(scrolled)
+		
+		self.window.show_all()
+		iterate()
+	
+	def tearDown(self):
+		self.window.destroy()
+		iterate()
+
+@unittest.skipUnless(DISPLAY, "GTK+ or a display are not available")
+class TestPopulation(ListTests, unittest.TestCase):
+	
+	def populate(self, count):
+		"""
+		Adds `count` updates in the batches of updates-found, and
+		returns how long it took, drawing included.
+		"""
+		
+		updates = get_updates(count)
+		size = UpdateHandler.update_batch_size
+		
+		start = time.monotonic()
+		for offset in range(0, count, size):
+			self.list.add_items(updates[offset:offset + size])
+			iterate()
+		self.list.expand_all()
+		iterate()
+		
+		return time.monotonic() - start
+	
+	def test_population(self):
+		for count in (10, 1000, 10000):
+			with self.subTest(count=count):
+				self.list.clear()
+				iterate()
+				
+				elapsed = self.populate(count)
+				print("\n%d packages listed in %.3fs" % (count, elapsed))
+				
+				self.assertEqual(len(self.list.index), count)
+				self.assertFalse(self.list.props.empty)
+
+@unittest.skipUnless(DISPLAY, "GTK+ or a display are not available")
+class TestBulk(ListTests, unittest.TestCase):
+	
+	COUNT = 5000
+	
+	def add(self, threshold):
+		"""
+		Adds COUNT updates in one go, with the model detached from the
+		view if there are at least `threshold` of them. Returns how
+		long it took, drawing included.
+		"""
+		
+		# Start with every section expanded
+		self.list.clear()
+		self.list.add_items(get_updates(len(REASONS)))
+		self.list.expand_all()
+		iterate()
+		
+		self.list.bulk_threshold = threshold
+		
+		start = time.monotonic()
+		self.list.add_items(get_updates(self.COUNT))
+		iterate()
+		
+		return time.monotonic() - start
+	
+	def test_bulk(self):
+		attached = self.add(self.COUNT + 1)
+		detached = self.add(self.COUNT)
+		
+		print(
+			"\n%d packages listed in %.3fs, %.3fs in bulk mode" % (
+				self.COUNT, attached, detached
+			)
+		)
+		
+		self.assertEqual(len(self.list.index), self.COUNT)
+		self.assertIs(self.list.get_model(), self.list.view_model)
+		
+		# The sections are still expanded
+		model = self.list.get_model()
+		for row in model:
+			if model.iter_has_child(row.iter):
+				self.assertTrue(self.list.row_expanded(row.path))
+
+if __name__ == "__main__":
+	unittest.main()